@@ -31,9 +31,10 @@
 ################################################################################
 
 import os, sys, platform, re, datetime, time
-import socket, base64, hashlib
+import socket, select, base64, hashlib
 import threading, random
-import errno, codecs
+import errno, codecs, collections, heapq
+import email.utils, atexit
 import subprocess
 import tempfile
 
@@ -54,6 +55,12 @@ else:
 
 lock = threading.RLock()
 
+# Download journal, when enabled for a cache run
+gJournal = None
+
+# Persistent cache of artwork that could not be downloaded, when enabled for a cache run
+gFailureCache = None
+
 #
 # Config class. Will be a global object.
 #
@@ -204,9 +211,27 @@ class MyConfiguration(object):
 
     # Read library and textures data in chunks to minimise server/client memory usage
     self.CHUNKED = self.getBoolean(config, "chunked", "yes")
+    # Pass library items to be processed as each chunk is loaded, rather than once all chunks are loaded
+    self.CHUNKED_STREAM = self.getBoolean(config, "chunked.stream", "no")
+    # Adjust chunk size to approach a target response size (KB), and number of chunk requests to keep
+    # in flight (requires rpc.shared)
+    self.CHUNKED_ADAPTIVE = self.getBoolean(config, "chunked.adaptive", "no")
+    self.CHUNKED_TARGET = int(self.getValue(config, "chunked.target", "1024"))
+    self.CHUNKED_INFLIGHT = int(self.getValue(config, "chunked.inflight", "1"))
+    self.CHUNKED_INFLIGHT = 1 if self.CHUNKED_INFLIGHT < 1 else self.CHUNKED_INFLIGHT
 
     self.DBJSON = self.getValue(config, "dbjson", "auto")
     self.USEJSONDB = self.getBoolean(config, "dbjson", "yes")
+    # Match library artwork against a SQLite texture database by joining on a temporary table of library URLs
+    self.DBJOIN = self.getBoolean(config, "dbjoin", "yes")
+    # Open SQLite texture database read-only (optionally as a private snapshot copy) when only reading,
+    # and size (MB) of memory map and page cache used by SQLite connections
+    self.DBREADONLY = self.getBoolean(config, "dbreadonly", "yes")
+    self.DBSNAPSHOT = self.getBoolean(config, "dbsnapshot", "no")
+    self.DBMMAP = int(self.getValue(config, "dbmmap", "256"))
+    self.DBCACHE = int(self.getValue(config, "dbcache", "64"))
+    # Number of connections used to read texture database folders in parallel
+    self.DBTHREADS = int(self.getValue(config, "dbthreads", "1"))
 
     if self.KODI_BASE[-1:] not in ["/", "\\"]: self.KODI_BASE += "/"
     if self.THUMBNAILS[-1:] not in ["/", "\\"]: self.THUMBNAILS += "/"
@@ -220,11 +245,20 @@ class MyConfiguration(object):
     if self.KODI_HOST is None:
       self.KODI_HOST = self.getValue(config, "kodi.host", "localhost")
     self.WEB_PORT = self.getValue(config, "webserver.port", "8080")
+    # Use a new connection for each web request, otherwise keep connections alive until
+    # a number of failures suggests the webserver doesn't handle persistent connections
     self.WEB_SINGLESHOT = self.getBoolean(config, "webserver.singleshot", "no")
+    self.web_failures = 0
+    self.web_timeouts = 0
     self.RPC_PORT = self.getValue(config, "rpc.port", "9090")
     self.RPC_IPVERSION = self.getValue(config, "rpc.ipversion", "")
     self.RPC_RETRY = int(self.getValue(config, "rpc.retry", "12"))
     self.RPC_RETRY = 0 if self.RPC_RETRY < 0 else self.RPC_RETRY
+    # Maximum number of requests per JSON-RPC batch - 0 or 1 to disable batching
+    self.RPC_BATCHSIZE = int(self.getValue(config, "rpc.batchsize", "200"))
+    self.RPC_BATCHSIZE = 0 if self.RPC_BATCHSIZE < 0 else self.RPC_BATCHSIZE
+    # Share a single RPC connection between all threads
+    self.RPC_SHARED = self.getBoolean(config, "rpc.shared", "no")
 
     web_user = self.getValue(config, "webserver.username", "")
     web_pass = self.getValue(config, "webserver.password", "")
@@ -250,8 +284,18 @@ class MyConfiguration(object):
 
     self.DOWNLOAD_THREADS_DEFAULT = int(self.getValue(config, "download.threads", "2"))
     self.DOWNLOAD_RETRY = int(self.getValue(config, "download.retry", "3"))
+    # When non-zero, failed downloads are retried later with exponential backoff starting
+    # from this number of seconds, rather than immediately on the same thread
+    self.DOWNLOAD_RETRY_BACKOFF = float(self.getValue(config, "download.retry.backoff", "0"))
     self.DOWNLOAD_PRIME = self.getBoolean(config, "download.prime", "yes")
 
+    # Build image download URLs locally rather than calling Files.PrepareDownload for
+    # every image. The first few URLs are compared with Files.PrepareDownload, and
+    # local URLs are abandoned for the rest of the run if there is any difference.
+    self.DOWNLOAD_LOCALURL = self.getBoolean(config, "download.localurl", "no")
+    self.DOWNLOAD_LOCALURL_CHECK = int(self.getValue(config, "download.localurl.check", "5"))
+    self.localurl_checked = 0
+
     # It seems that Files.Preparedownload is sufficient to populate the texture cache
     # so there is no need to actually download the artwork.
     # v0.8.8: Leave enabled for now, may only be sufficient in recent builds.
@@ -262,8 +306,38 @@ class MyConfiguration(object):
       temp = int(self.getValue(config, "download.threads.%s" % x, self.DOWNLOAD_THREADS_DEFAULT))
       self.DOWNLOAD_THREADS["download.threads.%s" % x] = temp
 
+    # Automatically adjust the number of download threads at runtime, between min and max
+    self.DOWNLOAD_THREADS_AUTO = self.getBoolean(config, "download.threads.auto", "no")
+    self.DOWNLOAD_THREADS_MIN = int(self.getValue(config, "download.threads.min", "1"))
+    self.DOWNLOAD_THREADS_MAX = int(self.getValue(config, "download.threads.max", "8"))
+
     self.SINGLETHREAD_URLS = self.getPatternFromList(config, "singlethread.urls", serial_urls, allowundefined=True)
 
+    # Resolve download URLs in a separate stage with its own threads, running up to
+    # download.prepare.queue items ahead of the download threads. 0 to disable.
+    self.DOWNLOAD_PREPARE_THREADS = int(self.getValue(config, "download.prepare.threads", "0"))
+    self.DOWNLOAD_PREPARE_QUEUE = int(self.getValue(config, "download.prepare.queue", "50"))
+
+    # Per-domain limits applied by the download scheduler. Domains matching singlethread.urls
+    # are always limited to one thread. 0 means no limit.
+    self.DOWNLOAD_DOMAIN_THREADS = int(self.getValue(config, "download.domain.threads", "0"))
+    self.DOWNLOAD_DOMAIN_RATE = float(self.getValue(config, "download.domain.rate", "0"))
+    self.DOWNLOAD_DOMAIN_BANDWIDTH = float(self.getValue(config, "download.domain.bandwidth", "0"))
+
+    # Limits across all domains - downloads per second, and bytes per second. 0 means no limit.
+    self.DOWNLOAD_RATE = float(self.getValue(config, "download.rate", "0"))
+    self.DOWNLOAD_BANDWIDTH = float(self.getValue(config, "download.bandwidth", "0"))
+
+    # Stop downloading from a domain after this many consecutive failures (0 to disable),
+    # trying again once the cooldown period (seconds) has elapsed
+    self.DOWNLOAD_BREAKER = int(self.getValue(config, "download.breaker", "0"))
+    self.DOWNLOAD_BREAKER_COOLDOWN = float(self.getValue(config, "download.breaker.cooldown", "60"))
+
+    # Maximum number of concurrent downloads while Kodi is playing or scanning the library,
+    # checked every interval seconds. 0 pauses downloads, -1 to ignore Kodi activity.
+    self.DOWNLOAD_ACTIVITY_THREADS = int(self.getValue(config, "download.activity.threads", "-1"))
+    self.DOWNLOAD_ACTIVITY_INTERVAL = float(self.getValue(config, "download.activity.interval", "10"))
+
     self.XTRAJSON = {}
     self.QA_FIELDS = {}
 
@@ -335,6 +409,9 @@ class MyConfiguration(object):
 
     (self.CACHE_REFRESH, self.cache_refresh_date, self.cache_refresh_date_fmt) = self.getRelativeDateAndFormat(config, "cache.refresh", "")
 
+    # When re-caching, only replace remote artwork that has changed since it was cached
+    self.CACHE_REVALIDATE = self.getBoolean(config, "cache.revalidate", "no")
+
     yn = "yes" if self.getBoolean(config, "cache.extra", "no") else "no"
     self.CACHE_EXTRA_FANART = self.getBoolean(config, "cache.extrafanart", yn)
     self.CACHE_EXTRA_THUMBS = self.getBoolean(config, "cache.extrathumbs", yn)
@@ -353,6 +430,34 @@ class MyConfiguration(object):
 
     self.CACHE_DROP_INVALID_FILE = self.getValue(config, "cache.dropfile", "")
 
+    # Parse, match and download artwork while the library is still loading
+    self.CACHE_PIPELINE = self.getBoolean(config, "cache.pipeline", "no")
+
+    # Download the artwork most likely to be seen first - by image type in order of
+    # cache.priority.artwork, then most recently used, then most recently added
+    self.CACHE_PRIORITY = self.getBoolean(config, "cache.priority", "no")
+    self.CACHE_PRIORITY_ARTWORK = self.getSimpleList(config, "cache.priority.artwork", "poster, fanart, thumb, banner, clearlogo, clearart, landscape, icon")
+
+    # Journal of queued and completed downloads, used to resume an interrupted c/C run
+    self.CACHE_JOURNAL = self.getValue(config, "cache.journal", "")
+
+    # Process only one slice of the artwork, eg. "2/4" for the second of four slices, so that
+    # a run can be split across several processes. Totals are written to the summary file,
+    # and summaries from all slices combined with the "mergeshards" command.
+    self.CACHE_SHARD = self.getValue(config, "cache.shard", "")
+    self.CACHE_SHARD_SUMMARY = self.getValue(config, "cache.shard.summary", "")
+    self.cache_shard = None
+    if self.CACHE_SHARD:
+      m = re.match("^[ ]*([0-9]+)[ ]*/[ ]*([0-9]+)[ ]*$", self.CACHE_SHARD)
+      if not m or not (1 <= int(m.group(1)) <= int(m.group(2))):
+        print("Invalid cache.shard [%s] - should be \"i/n\", where i is 1 to n" % self.CACHE_SHARD)
+        sys.exit(2)
+      self.cache_shard = (int(m.group(1)) - 1, int(m.group(2)))
+
+    # Remember artwork that could not be downloaded, and skip it for ttl days
+    self.CACHE_FAILURES = self.getValue(config, "cache.failures", "")
+    self.CACHE_FAILURES_TTL = float(self.getValue(config, "cache.failures.ttl", "7"))
+
     # Fix patterns as we now strip image:// from the URLs, so we need to remove
     # this prefix from any legacy patterns that may be specified by the user
     for index, r in enumerate(self.CACHE_IGNORE_TYPES):
@@ -774,25 +879,55 @@ class MyConfiguration(object):
     print("  thumbnails = %s " % self.THUMBNAILS)
     print("  kodi.host = %s" % self.KODI_HOST)
     print("  webserver.port = %s" % self.WEB_PORT)
+    print("  webserver.singleshot = %s" % self.BooleanIsYesNo(self.WEB_SINGLESHOT))
     print("  webserver.ctimeout = %s" % self.NoneIsBlank(self.WEB_CONNECTTIMEOUT))
     print("  rpc.port = %s" % self.RPC_PORT)
     print("  rpc.ipversion = %s" % self.RPC_IPVERSION)
     print("  rpc.retry = %s" % self.RPC_RETRY)
+    print("  rpc.batchsize = %d" % self.RPC_BATCHSIZE)
+    print("  rpc.shared = %s" % self.BooleanIsYesNo(self.RPC_SHARED))
     print("  rpc.ctimeout = %s" % self.NoneIsBlank(self.RPC_CONNECTTIMEOUT))
     print("  chunked = %s" % self.BooleanIsYesNo(self.CHUNKED))
+    print("  chunked.stream = %s" % self.BooleanIsYesNo(self.CHUNKED_STREAM))
+    print("  chunked.adaptive = %s" % self.BooleanIsYesNo(self.CHUNKED_ADAPTIVE))
+    print("  chunked.target = %d" % self.CHUNKED_TARGET)
+    print("  chunked.inflight = %d" % self.CHUNKED_INFLIGHT)
+    print("  dbjoin = %s" % self.BooleanIsYesNo(self.DBJOIN))
+    print("  dbreadonly = %s" % self.BooleanIsYesNo(self.DBREADONLY))
+    print("  dbsnapshot = %s" % self.BooleanIsYesNo(self.DBSNAPSHOT))
+    print("  dbmmap = %d" % self.DBMMAP)
+    print("  dbcache = %d" % self.DBCACHE)
+    print("  dbthreads = %d" % self.DBTHREADS)
     print("  modifieddate.mdy = %s" % self.BooleanIsYesNo(self.MDATE_MDY))
     print("  query.seasons = %s" % self.BooleanIsYesNo(self.QUERY_SEASONS))
     print("  query.episodes = %s" % self.BooleanIsYesNo(self.QUERY_EPISODES))
     print("  download.predelete = %s" % self.BooleanIsYesNo(self.DOWNLOAD_PREDELETE))
     print("  download.payload = %s" % self.BooleanIsYesNo(self.DOWNLOAD_PAYLOAD))
     print("  download.retry = %d" % self.DOWNLOAD_RETRY)
+    print("  download.retry.backoff = %s" % self.DOWNLOAD_RETRY_BACKOFF)
     print("  download.prime = %s" % self.BooleanIsYesNo(self.DOWNLOAD_PRIME))
+    print("  download.localurl = %s" % self.BooleanIsYesNo(self.DOWNLOAD_LOCALURL))
+    print("  download.localurl.check = %d" % self.DOWNLOAD_LOCALURL_CHECK)
     print("  download.threads = %d" % self.DOWNLOAD_THREADS_DEFAULT)
     if self.DOWNLOAD_THREADS != {}:
       for dt in self.DOWNLOAD_THREADS:
         if self.DOWNLOAD_THREADS[dt] != self.DOWNLOAD_THREADS_DEFAULT:
           print("  %s = %d" % (dt, self.DOWNLOAD_THREADS[dt]))
+    print("  download.threads.auto = %s" % self.BooleanIsYesNo(self.DOWNLOAD_THREADS_AUTO))
+    print("  download.threads.min = %d" % self.DOWNLOAD_THREADS_MIN)
+    print("  download.threads.max = %d" % self.DOWNLOAD_THREADS_MAX)
+    print("  download.prepare.threads = %d" % self.DOWNLOAD_PREPARE_THREADS)
+    print("  download.prepare.queue = %d" % self.DOWNLOAD_PREPARE_QUEUE)
     print("  singlethread.urls = %s" % self.NoneIsBlank(self.getListFromPattern(self.SINGLETHREAD_URLS)))
+    print("  download.domain.threads = %d" % self.DOWNLOAD_DOMAIN_THREADS)
+    print("  download.domain.rate = %s" % self.DOWNLOAD_DOMAIN_RATE)
+    print("  download.domain.bandwidth = %s" % self.DOWNLOAD_DOMAIN_BANDWIDTH)
+    print("  download.rate = %s" % self.DOWNLOAD_RATE)
+    print("  download.bandwidth = %s" % self.DOWNLOAD_BANDWIDTH)
+    print("  download.breaker = %d" % self.DOWNLOAD_BREAKER)
+    print("  download.breaker.cooldown = %s" % self.DOWNLOAD_BREAKER_COOLDOWN)
+    print("  download.activity.threads = %d" % self.DOWNLOAD_ACTIVITY_THREADS)
+    print("  download.activity.interval = %s" % self.DOWNLOAD_ACTIVITY_INTERVAL)
     print("  extrajson.addons  = %s" % self.NoneIsBlank(self.XTRAJSON["extrajson.addons"]))
     print("  extrajson.agenres = %s" % self.NoneIsBlank(self.XTRAJSON["extrajson.agenres"]))
     print("  extrajson.vgenres = %s" % self.NoneIsBlank(self.XTRAJSON["extrajson.vgenres"]))
@@ -826,7 +961,16 @@ class MyConfiguration(object):
     print("  cache.extrathumbs = %s" % self.BooleanIsYesNo(self.CACHE_EXTRA_THUMBS))
     print("  cache.videoextras = %s" % self.BooleanIsYesNo(self.CACHE_VIDEO_EXTRAS))
     print("  cache.refresh = %s%s" % (self.NoneIsBlank(self.CACHE_REFRESH), " (%s)" % self.cache_refresh_date_fmt if self.cache_refresh_date_fmt else ""))
+    print("  cache.revalidate = %s" % self.BooleanIsYesNo(self.CACHE_REVALIDATE))
     print("  cache.dropfile = %s" % self.NoneIsBlank(self.CACHE_DROP_INVALID_FILE))
+    print("  cache.pipeline = %s" % self.BooleanIsYesNo(self.CACHE_PIPELINE))
+    print("  cache.priority = %s" % self.BooleanIsYesNo(self.CACHE_PRIORITY))
+    print("  cache.priority.artwork = %s" % self.NoneIsBlank(", ".join(self.CACHE_PRIORITY_ARTWORK)))
+    print("  cache.journal = %s" % self.NoneIsBlank(self.CACHE_JOURNAL))
+    print("  cache.shard = %s" % self.NoneIsBlank(self.CACHE_SHARD))
+    print("  cache.shard.summary = %s" % self.NoneIsBlank(self.CACHE_SHARD_SUMMARY))
+    print("  cache.failures = %s" % self.NoneIsBlank(self.CACHE_FAILURES))
+    print("  cache.failures.ttl = %s" % self.CACHE_FAILURES_TTL)
     print("  prune.retain.types = %s" % self.NoneIsBlank(self.getListFromPattern(self.PRUNE_RETAIN_TYPES)))
     print("  prune.retain.previews = %s" % self.BooleanIsYesNo(self.PRUNE_RETAIN_PREVIEWS))
     print("  prune.retain.pictures = %s" % self.BooleanIsYesNo(self.PRUNE_RETAIN_PICTURES))
@@ -1072,18 +1216,720 @@ class MyLogger():
     sys.stderr.flush()
     if self.LOGFILE: self.LOGFILE.flush()
 
+#
+# Token bucket rate limiter - up to rate tokens per second, with bursts of up
+# to burst tokens.
+#
+class MyTokenBucket(object):
+  def __init__(self, rate, burst=None):
+    self.rate = float(rate)
+    self.burst = float(burst if burst else max(1.0, self.rate))
+    self.tokens = self.burst
+    self.timestamp = time.time()
+    self.lock = threading.Lock()
+
+  def refill(self):
+    now = time.time()
+    self.tokens = min(self.burst, self.tokens + (now - self.timestamp) * self.rate)
+    self.timestamp = now
+
+  # Return the number of seconds to wait before enough tokens will be available,
+  # without taking them
+  def delay(self, tokens=1):
+    with self.lock:
+      self.refill()
+      return max(0, (tokens - self.tokens) / self.rate)
+
+  # Take tokens if available and return 0, otherwise return the number
+  # of seconds to wait before enough tokens will be available.
+  def take(self, tokens=1):
+    with self.lock:
+      self.refill()
+      if self.tokens >= tokens:
+        self.tokens -= tokens
+        return 0
+      return (tokens - self.tokens) / self.rate
+
+  # Take tokens once their number is known (eg. bytes transferred), going into debt
+  # if necessary - nothing more can be taken until the debt is repaid
+  def charge(self, tokens):
+    with self.lock:
+      self.refill()
+      self.tokens -= tokens
+
+#
+# Circuit breaker for a download domain. After threshold consecutive failures the
+# breaker opens and requests are refused until cooldown seconds have elapsed, then a
+# single probe request is allowed. Success of the probe closes the breaker, failure
+# opens it again for another cooldown period.
+#
+class MyCircuitBreaker(object):
+  CLOSED = "closed"
+  OPEN = "open"
+  PROBE = "probe"
+
+  def __init__(self, logger, name, threshold, cooldown):
+    self.logger = logger
+    self.name = name
+    self.threshold = threshold
+    self.cooldown = cooldown
+
+    self.state = self.CLOSED
+    self.failures = 0
+    self.opened = 0
+    self.lock = threading.Lock()
+
+  # Return True if a request may proceed
+  def allow(self):
+    with self.lock:
+      if self.state == self.CLOSED:
+        return True
+      if self.state == self.OPEN and time.time() >= self.opened + self.cooldown:
+        self.logger.log("Circuit breaker [%s]: cooldown elapsed, probing" % self.name)
+        self.state = self.PROBE
+        return True
+      return False
+
+  # Seconds until a probe request will be allowed
+  def remaining(self):
+    with self.lock:
+      return max(0.0, self.opened + self.cooldown - time.time())
+
+  def success(self):
+    with self.lock:
+      if self.state != self.CLOSED:
+        self.logger.log("Circuit breaker [%s]: closed" % self.name)
+      self.state = self.CLOSED
+      self.failures = 0
+
+  def failure(self):
+    with self.lock:
+      self.failures += 1
+      if self.state == self.PROBE or (self.state == self.CLOSED and self.failures >= self.threshold):
+        self.logger.log("Circuit breaker [%s]: open after %d consecutive failure(s)" % (self.name, self.failures))
+        self.state = self.OPEN
+        self.opened = time.time()
+
+#
+# Download work scheduler. Items are queued by domain, and each domain has its
+# own concurrency and rate limit. Threads take work from whichever domain has
+# capacity, so a slow or serialised domain won't hold up the other domains.
+#
+class MyWorkScheduler(object):
+  RE_DOMAIN = re.compile("^([a-z0-9+.@-]+)://([^/]*)", flags=re.IGNORECASE)
+
+  def __init__(self, config, logger, closed=True):
+    self.config = config
+    self.logger = logger
+
+    # While not closed, more items may be added so threads wait for work
+    # rather than exiting when the queue is empty
+    self.closed = closed
+
+    self.cond = threading.Condition()
+    self.domains = {}
+    self.order = []
+    self.next = 0
+    self.pending = 0
+    self.retiring = 0
+    self.deferred = []
+    self.deferred_seq = 0
+    self.seq = 0
+
+    # Limit on concurrent downloads across all domains, or None when unlimited
+    self.throttle = None
+    self.active = 0
+
+    # When items are prepared ahead of download, set by setPrepared()
+    self.prepared = False
+
+    # Downloads per second and bytes per second across all domains
+    self.bucket = MyTokenBucket(config.DOWNLOAD_RATE) if config.DOWNLOAD_RATE > 0 else None
+    self.bandwidth = MyTokenBucket(config.DOWNLOAD_BANDWIDTH) if config.DOWNLOAD_BANDWIDTH > 0 else None
+
+  # Return domain key, and whether the domain is serialised
+  def getDomain(self, item):
+    url = item.decoded_filename or ""
+
+    for site in self.config.SINGLETHREAD_URLS:
+      if site.search(url):
+        return (site.pattern, True)
+
+    m = self.RE_DOMAIN.search(url)
+    if m:
+      return ("%s://%s" % (m.group(1).lower(), m.group(2).lower()), False)
+    else:
+      return ("local", False)
+
+  def put(self, item):
+    (key, serial) = self.getDomain(item)
+
+    with self.cond:
+      domain = self.domains.get(key, None)
+      if domain is None:
+        if serial:
+          limit = 1
+        else:
+          limit = self.config.DOWNLOAD_DOMAIN_THREADS
+        if self.config.DOWNLOAD_DOMAIN_RATE > 0 and key.split(":")[0] in ["http", "https"]:
+          bucket = MyTokenBucket(self.config.DOWNLOAD_DOMAIN_RATE)
+        else:
+          bucket = None
+        if self.config.DOWNLOAD_BREAKER > 0:
+          breaker = MyCircuitBreaker(self.logger, key, self.config.DOWNLOAD_BREAKER, self.config.DOWNLOAD_BREAKER_COOLDOWN)
+        else:
+          breaker = None
+        if self.config.DOWNLOAD_DOMAIN_BANDWIDTH > 0:
+          bandwidth = MyTokenBucket(self.config.DOWNLOAD_DOMAIN_BANDWIDTH)
+        else:
+          bandwidth = None
+        domain = {"key": key, "serial": serial, "limit": limit, "active": 0, "downloading": 0,
+                  "queue": [], "bucket": bucket, "bandwidth": bandwidth, "breaker": breaker}
+        self.domains[key] = domain
+        self.order.append(domain)
+        self.logger.log("Scheduler: new domain [%s], thread limit %d, rate %s" % (key, limit, self.config.DOWNLOAD_DOMAIN_RATE if bucket else 0))
+
+      item.domain = key
+      self.enqueue(domain, item)
+      self.pending += 1
+      self.cond.notify()
+
+    return serial
+
+  # Return the next item from any domain with capacity, blocking if necessary
+  # until a domain has capacity. Returns None once there is no more work.
+  def get(self):
+    with self.cond:
+      # Items in flight may yet be deferred, so wait until they are done
+      while (self.pending > 0 or self.active > 0 or not self.closed) and not stopped.is_set():
+        if self.retiring > 0:
+          self.retiring -= 1
+          return None
+
+        # Return deferred items to their domain queue once due
+        now = time.time()
+        while self.deferred and self.deferred[0][0] <= now:
+          item = heapq.heappop(self.deferred)[2]
+          self.enqueue(self.domains[item.domain], item)
+        wait = (self.deferred[0][0] - now) if self.deferred else None
+
+        if self.throttle is not None and self.active >= self.throttle:
+          self.cond.wait(1.0)
+          continue
+
+        # Wait for the global budgets, if any
+        delay = max(self.bucket.delay() if self.bucket else 0, self.bandwidth.delay(0) if self.bandwidth else 0)
+        if delay > 0:
+          self.cond.wait(delay if wait is None else min(wait, delay))
+          continue
+
+        # Domains are normally served in turn, but when prioritised the domain
+        # holding the highest priority item is served first
+        count = len(self.order)
+        if self.config.CACHE_PRIORITY:
+          candidates = sorted([d for d in self.order if d["queue"]], key=lambda d: d["queue"][0])
+        else:
+          candidates = [self.order[(self.next + i) % count] for i in range(count)]
+
+        # With a prepare stage, a domain may have as many items being prepared
+        # as being downloaded
+        depth = 2 if self.prepared else 1
+
+        for i, domain in enumerate(candidates):
+          if not domain["queue"]: continue
+          if domain["limit"] > 0 and domain["active"] >= domain["limit"] * depth: continue
+          if domain["bandwidth"]:
+            delay = domain["bandwidth"].delay(0)
+            if delay > 0:
+              wait = delay if wait is None else min(wait, delay)
+              continue
+          if domain["bucket"]:
+            delay = domain["bucket"].take()
+            if delay > 0:
+              wait = delay if wait is None else min(wait, delay)
+              continue
+          if self.bucket: self.bucket.take()
+          self.next = (self.next + i + 1) % count
+          domain["active"] += 1
+          self.active += 1
+          self.pending -= 1
+          return heapq.heappop(domain["queue"])[2]
+        self.cond.wait(wait if wait is not None else 1.0)
+      return None
+
+  # Account for the bytes transferred by a download
+  def charge(self, item, nbytes):
+    with self.cond:
+      if self.bandwidth: self.bandwidth.charge(nbytes)
+      if self.domains[item.domain]["bandwidth"]: self.domains[item.domain]["bandwidth"].charge(nbytes)
+
+  # Domain queues are heaps ordered by item priority, then by order of arrival
+  def enqueue(self, domain, item):
+    self.seq += 1
+    heapq.heappush(domain["queue"], (item.priority, self.seq, item))
+
+  def getBreaker(self, item):
+    with self.cond:
+      return self.domains[item.domain]["breaker"]
+
+  # Queue an item again once delay seconds have elapsed
+  def defer(self, item, delay):
+    with self.cond:
+      self.deferred_seq += 1
+      heapq.heappush(self.deferred, (time.time() + delay, self.deferred_seq, item))
+      self.pending += 1
+      self.cond.notify()
+
+  # Items are prepared ahead of download, and need a download slot from acquire()
+  def setPrepared(self, enabled):
+    with self.cond:
+      self.prepared = enabled
+      self.cond.notify_all()
+
+  # Wait for a download slot in the domain of a prepared item. Returns False if stopped.
+  def acquire(self, item):
+    with self.cond:
+      domain = self.domains[item.domain]
+      while domain["limit"] > 0 and domain["downloading"] >= domain["limit"]:
+        if stopped.is_set(): return False
+        self.cond.wait(1.0)
+      domain["downloading"] += 1
+      return True
+
+  # Release the domain capacity used by an item, including its download slot if acquired
+  def done(self, item, downloading=False):
+    with self.cond:
+      self.domains[item.domain]["active"] -= 1
+      if downloading: self.domains[item.domain]["downloading"] -= 1
+      self.active -= 1
+      self.cond.notify_all()
+
+  # Limit the number of concurrent downloads, None to remove the limit
+  def setThrottle(self, limit):
+    with self.cond:
+      self.throttle = limit
+      self.cond.notify_all()
+
+  # No more items will be added
+  def close(self):
+    with self.cond:
+      self.closed = True
+      self.cond.notify_all()
+
+  # Ask a number of threads to exit, each will exit before taking its next item
+  def retire(self, count):
+    with self.cond:
+      self.retiring += count
+      self.cond.notify_all()
+
+  def qsize(self, serial=None):
+    with self.cond:
+      return sum([len(d["queue"]) for d in self.order if serial is None or d["serial"] == serial]) + \
+             sum([1 for d in self.deferred if serial is None or self.domains[d[2].domain]["serial"] == serial])
+
+  def empty(self):
+    return self.qsize() == 0
+
+#
+# Queue of items resolved by the prepare stage, waiting for a download thread.
+# Download threads are retired using a counter, so that retiring a thread never
+# waits behind prepared items in a full queue.
+#
+class MyPreparedQueue(Queue.Queue):
+  def __init__(self, maxsize):
+    Queue.Queue.__init__(self, maxsize)
+    self.retiring = 0
+    self.finished = False
+
+  # Return the next prepared item, or None once the calling thread should exit
+  def getPrepared(self):
+    while True:
+      with self.mutex:
+        if self.retiring > 0:
+          self.retiring -= 1
+          return None
+      # Nothing more is queued once finished, so empty means there is no more work
+      finished = self.finished
+      try:
+        return self.get(timeout=0.5)
+      except Queue.Empty:
+        if finished or stopped.is_set(): return None
+
+  # Ask a number of download threads to exit, each will exit before taking its next item
+  def retire(self, count):
+    with self.mutex:
+      self.retiring += count
+
+  # The prepare stage has finished, and no more items will be added
+  def finish(self):
+    self.finished = True
+
+#
+# Download thread tuner. Throughput, latency and errors are sampled over a fixed
+# window, and the number of threads is adjusted one at a time in whichever
+# direction last improved throughput. Threads are removed when latency or errors
+# increase, as that usually means Kodi is struggling to keep up.
+#
+class MyDownloadTuner(object):
+  WINDOW = 5.0
+
+  def __init__(self, config, logger, totals, threads):
+    self.config = config
+    self.logger = logger
+    self.totals = totals
+
+    self.min = max(1, config.DOWNLOAD_THREADS_MIN)
+    self.max = max(self.min, config.DOWNLOAD_THREADS_MAX)
+    self.threads = threads
+    self.direction = 1
+    self.last_tput = 0.0
+    self.best_latency = None
+
+    self.reset()
+
+  # Webserver timeouts and connection failures suggest Kodi is overloaded, whereas
+  # individual items that fail to download (eg. missing artwork) are no reflection on load
+  def getErrors(self):
+    return self.config.web_failures + self.config.web_timeouts
+
+  def reset(self):
+    self.completed = 0
+    self.elapsed = 0.0
+    self.errors = self.getErrors()
+    with lock:
+      self.pcount = self.totals.PCOUNT
+      self.pavg = self.totals.PAVG
+
+  # Accumulate a sample, returning the change in thread count once the window has elapsed
+  def sample(self, completed, interval):
+    self.completed += completed
+    self.elapsed += interval
+    if self.elapsed < self.WINDOW: return 0
+
+    tput = self.completed / self.elapsed
+    with lock:
+      pcount = self.totals.PCOUNT - self.pcount
+      latency = (self.totals.PAVG - self.pavg) / pcount if pcount != 0 else None
+    newerrors = self.getErrors() - self.errors
+
+    if latency is not None and (self.best_latency is None or latency < self.best_latency):
+      self.best_latency = latency
+
+    if newerrors > 0:
+      reason = "errors"
+      self.direction = -1
+      delta = -1
+    elif latency is not None and latency > self.best_latency * 2:
+      reason = "latency"
+      self.direction = -1
+      delta = -1
+    elif tput >= self.last_tput * 1.05:
+      reason = "improved"
+      delta = self.direction
+    elif tput < self.last_tput * 0.95:
+      reason = "degraded"
+      self.direction = -self.direction
+      delta = self.direction
+    else:
+      reason = "steady"
+      delta = 0
+
+    delta = max(self.min, min(self.max, self.threads + delta)) - self.threads
+
+    self.logger.log("Tuner: %05.2f downloads per second (previous %05.2f), latency %s, errors %d - %s, threads %d -> %d" %
+                    (tput, self.last_tput, "%0.3f" % latency if latency is not None else "n/a", newerrors,
+                     reason, self.threads, self.threads + delta))
+
+    self.threads += delta
+    self.last_tput = tput
+    self.reset()
+
+    return delta
+
+#
+# Monitor Kodi for video/audio playback and library scans, so that downloads can be
+# throttled while Kodi is busy and resumed at full speed once Kodi is idle again.
+#
+class MyActivityMonitor(object):
+  def __init__(self, config, logger):
+    self.config = config
+    self.logger = logger
+    self.jcomms = MyJSONComms(config, logger)
+    self.lastcheck = 0
+    self.busy = None
+
+  # Return a description of the current Kodi activity, or None if Kodi is idle
+  def getActivity(self):
+    activity = []
+
+    REQUEST = {"method": "Player.GetActivePlayers"}
+    data = self.jcomms.sendJSON(REQUEST, "libPlayers", checkResult=False)
+    for player in data.get("result", []):
+      activity.append("playing %s" % player.get("type", "media"))
+
+    REQUEST = {"method": "XBMC.GetInfoBooleans",
+               "params": {"booleans": ["Library.IsScanningMusic", "Library.IsScanningVideo"]}}
+    data = self.jcomms.sendJSON(REQUEST, "libBooleans", checkResult=False)
+    values = data.get("result", {})
+    if values.get("Library.IsScanningMusic", False): activity.append("scanning music")
+    if values.get("Library.IsScanningVideo", False): activity.append("scanning video")
+
+    return ", ".join(activity) if activity else None
+
+  # Check Kodi activity once the interval has elapsed, throttling the scheduler when
+  # Kodi becomes busy. Returns True while downloads are being throttled.
+  def check(self, work_queue):
+    if time.time() - self.lastcheck < self.config.DOWNLOAD_ACTIVITY_INTERVAL:
+      return self.busy is not None
+    self.lastcheck = time.time()
+
+    try:
+      busy = self.getActivity()
+    except Exception as e:
+      self.logger.log("Activity: unable to query Kodi status: %s" % e)
+      busy = self.busy
+
+    if busy != self.busy:
+      if busy:
+        self.logger.log("Activity: Kodi is busy (%s), limiting downloads to %d thread(s)" % (busy, self.config.DOWNLOAD_ACTIVITY_THREADS))
+        work_queue.setThrottle(self.config.DOWNLOAD_ACTIVITY_THREADS)
+      else:
+        self.logger.log("Activity: Kodi is idle, resuming downloads")
+        work_queue.setThrottle(None)
+      self.busy = busy
+
+    return self.busy is not None
+
+#
+# Journal of queued and completed download items, written as one compact JSON record
+# per line. An interrupted cache run can then be resumed with only the outstanding items,
+# without loading and matching the media library again.
+#
+class MyJournal(object):
+  def __init__(self, config, logger):
+    self.config = config
+    self.logger = logger
+    self.filename = config.CACHE_JOURNAL
+    self.lock = threading.Lock()
+    self.jobid = 0
+    self.file = None
+
+  def open(self, force):
+    self.file = codecs.open(self.filename, "w", encoding="utf-8")
+    self.write(["job", force])
+
+  def close(self):
+    with self.lock:
+      if self.file:
+        self.file.close()
+        self.file = None
+
+  def write(self, record):
+    with self.lock:
+      if self.file:
+        self.file.write("%s\n" % json.dumps(record, separators=(",", ":")))
+        self.file.flush()
+
+  def media(self, mediatype):
+    self.write(["m", mediatype])
+
+  def queued(self, item):
+    with self.lock:
+      self.jobid += 1
+      item.jobid = self.jobid
+    self.write(["q", item.jobid, item.mtype, item.itype, item.name, item.season, item.episode,
+                item.filename, item.libraryid, item.missingOK])
+
+  def completed(self, item):
+    if item.jobid is not None:
+      self.write(["d", item.jobid])
+
+  # Return force flag, and a list of (mediatype, [items]) for items that were queued
+  # but not completed. An incomplete final record is ignored.
+  @staticmethod
+  def load(filename):
+    force = False
+    mediatype = None
+    jobs = collections.OrderedDict()
+
+    with codecs.open(filename, "r", encoding="utf-8") as infile:
+      for line in infile:
+        try:
+          record = json.loads(line)
+        except ValueError:
+          continue
+        if record[0] == "job":
+          force = record[1]
+        elif record[0] == "m":
+          mediatype = record[1]
+        elif record[0] == "q":
+          jobs[record[1]] = (mediatype, MyMediaItem(record[2], record[3], record[4], record[5], record[6],
+                                                    record[7], 0, None, record[8], record[9]))
+        elif record[0] == "d":
+          jobs.pop(record[1], None)
+
+    outstanding = collections.OrderedDict()
+    for (mediatype, item) in jobs.values():
+      if mediatype not in outstanding: outstanding[mediatype] = []
+      outstanding[mediatype].append(item)
+
+    return (force, list(outstanding.items()))
+
+#
+# Persistent cache of artwork URLs that could not be downloaded, with the reason and
+# time of failure. URLs that failed within the last ttl days are skipped by cache runs.
+#
+class MyFailureCache(object):
+  def __init__(self, config, logger):
+    self.config = config
+    self.logger = logger
+    self.filename = config.CACHE_FAILURES
+    self.ttl = config.CACHE_FAILURES_TTL * 86400
+    self.lock = threading.Lock()
+    self.failures = {}
+    self.modified = False
+
+  def load(self):
+    if not os.path.exists(self.filename): return
+
+    try:
+      with codecs.open(self.filename, "r", encoding="utf-8") as infile:
+        failures = json.load(infile)
+    except ValueError as e:
+      self.logger.log("Ignoring invalid failure cache %s: %s" % (self.filename, str(e)))
+      return
+
+    # Discard expired failures so that they are attempted again
+    expires = time.time() - self.ttl
+    self.failures = dict([(k, v) for (k, v) in failures.items() if v["time"] >= expires])
+    self.modified = (len(self.failures) != len(failures))
+    self.logger.log("Loaded %d known failure(s) from %s" % (len(self.failures), self.filename))
+
+  def save(self):
+    if not self.modified: return
+
+    tmpfile = "%s.tmp" % self.filename
+    with codecs.open(tmpfile, "w", encoding="utf-8") as outfile:
+      outfile.write(json.dumps(self.failures, indent=2, ensure_ascii=True, sort_keys=True))
+    os.rename(tmpfile, self.filename)
+    self.modified = False
+
+  def get(self, item):
+    with self.lock:
+      return self.failures.get(item.decoded_filename, None)
+
+  # Record the outcome of a download attempt
+  def update(self, item):
+    with self.lock:
+      if item.failure:
+        self.failures[item.decoded_filename] = {"reason": item.failure, "time": int(time.time())}
+        self.modified = True
+      elif item.decoded_filename in self.failures:
+        del self.failures[item.decoded_filename]
+        self.modified = True
+
+#
+# Cache pipeline producer thread. Library items are parsed and matched against the
+# texture cache in small groups as they are loaded, and anything that needs to be
+# cached is queued for download straight away rather than once the entire library
+# has been loaded, parsed and matched.
+#
+class MyCacheProducer(threading.Thread):
+  GROUP_SIZE = 25
+
+  def __init__(self, mediatype, jcomms, database, data, title_name, id_name, force, work_queue, drop_items):
+    threading.Thread.__init__(self)
+
+    self.mediatype = mediatype
+    self.jcomms = jcomms
+    self.database = database
+    self.data = data
+    self.title_name = title_name
+    self.id_name = id_name
+    self.force = force
+    self.work_queue = work_queue
+    self.drop_items = drop_items
+
+    self.itemCount = 0
+    self.error = None
+
+  def run(self):
+    try:
+      self.produce()
+    except Exception as e:
+      gLogger.log("Cache pipeline failed: %s" % str(e))
+      self.error = e
+    finally:
+      self.work_queue.close()
+
+  def produce(self):
+    ITEMLIMIT = 0 if self.force else 100
+
+    # With SQLite each group is matched using a join, otherwise artwork
+    # matching uses a hash of the entire texture cache
+    with self.database:
+      dbfiles = None
+      if not (gConfig.DBJOIN and not gConfig.USEJSONDB):
+        TOTALS.TimeStart(self.mediatype, "Compare")
+        dbfiles = {}
+        for r in self.database.iterRows(allfields=(self.force and (gConfig.CACHE_PRIORITY or gConfig.CACHE_REVALIDATE))):
+          dbfiles[r.url] = r
+        gLogger.log("Loaded %d items from texture cache database" % len(dbfiles))
+        TOTALS.TimeEnd(self.mediatype, "Compare")
+
+      imagecache = {}
+      imagecache[""] = 0
+
+      TOTALS.TimeStart(self.mediatype, "Parse")
+
+      group = []
+      for libraryitem in self.data:
+        if stopped.is_set(): break
+        group.append(libraryitem)
+        if len(group) >= self.GROUP_SIZE:
+          self.queueGroup(group, imagecache, dbfiles, ITEMLIMIT)
+          group = []
+      if group:
+        self.queueGroup(group, imagecache, dbfiles, ITEMLIMIT)
+
+      TOTALS.TimeEnd(self.mediatype, "Parse")
+
+  def queueGroup(self, group, imagecache, dbfiles, ITEMLIMIT):
+    mediaitems = []
+    parseURLData(self.jcomms, self.mediatype, mediaitems, imagecache, group, self.title_name, self.id_name)
+
+    tStart = time.time()
+    if dbfiles is None:
+      dbrows = joinTextureRows(self.database, mediaitems)
+    else:
+      dbrows = [dbfiles.get(item.decoded_filename, None) for item in mediaitems]
+    TOTALS.TimeAdd(self.mediatype, "Compare", time.time() - tStart)
+
+    for (item, dbrow) in zip(mediaitems, dbrows):
+      matchTextures_item_row(self.mediatype, self.jcomms, item, dbrow, self.force, False)
+      if item.status in [MyMediaItem.STATUS_MISSING, MyMediaItem.STATUS_STALE]:
+        if isKnownFailure(item, self.force, self.drop_items): continue
+        self.itemCount += 1
+        showCacheItem(item, self.itemCount, ITEMLIMIT)
+        queueCacheItem(self.work_queue, item)
+
+    # Discard seasons and episodes once parsed, so that only the current group
+    # is held in memory
+    for libraryitem in group:
+      libraryitem.pop("seasons", None)
+
 #
 # Image loader thread class.
 #
 class MyImageLoader(threading.Thread):
-  def __init__(self, work_queue, other_queue, error_queue, complete_queue,
-                config, logger, totals, force=False, retry=0):
+  def __init__(self, work_queue, error_queue, complete_queue,
+                config, logger, totals, force=False, retry=0, prepared_queue=None):
     threading.Thread.__init__(self)
 
     self.work_queue = work_queue
-    self.other_queue = other_queue
     self.error_queue = error_queue
     self.complete_queue = complete_queue
+    self.prepared_queue = prepared_queue
 
     self.config = config
     self.logger = logger
@@ -1099,45 +1945,98 @@ class MyImageLoader(threading.Thread):
   def run(self):
     with self.database:
       while not stopped.is_set():
+        # Items are taken from the prepare stage when enabled, otherwise directly from the scheduler
+        if self.prepared_queue:
+          item = self.prepared_queue.getPrepared()
+        else:
+          item = self.work_queue.get()
+        if item is None: break
+
+        downloading = False
         try:
-          item = self.work_queue.get(block=False)
-          self.work_queue.task_done()
+          # Prepared items wait for a download slot in their domain
+          if self.prepared_queue:
+            downloading = self.work_queue.acquire(item)
+            if not downloading: break
+
+          breaker = self.work_queue.getBreaker(item)
+          if breaker is None:
+            result = self.loadImage(item)
+          elif breaker.allow():
+            result = self.loadImage(item)
+            if result:
+              breaker.success()
+            else:
+              breaker.failure()
+          else:
+            result = self.refuseImage(item, breaker)
+
+          # Deferred items will be retried later, and aren't yet complete
+          if result is None:
+            delay = self.getbackoff(item)
+            if breaker: delay = max(delay, breaker.remaining())
+            self.work_queue.defer(item, delay)
+            continue
 
-          if not self.loadImage(item) and not item.missingOK:
+          if not result and not item.missingOK:
             self.error_queue.put(item)
 
           self.complete_queue.put(item)
 
-        except Queue.Empty:
-          break
-
         except IOEndOfReplayLog:
           break
 
+        finally:
+          self.work_queue.done(item, downloading)
+
     self.totals.stop()
     self.complete_queue.put(None)
 
-  def geturl(self, item):
-    PDRETRY = self.retry
+  # Fail an item without a request as its domain circuit breaker is open. Returns None
+  # to retry later if failed downloads are being deferred.
+  def refuseImage(self, item, breaker):
+    if self.candefer(item): return None
+
+    self.logger.log("Circuit breaker [%s] is open, not downloading filename [%s]" % (breaker.name, item.decoded_filename))
+    if not item.missingOK:
+      self.totals.bump("Error", item.itype)
+    return False
+
+  # Exponential backoff with jitter, based on the number of failed attempts
+  def getbackoff(self, item):
+    delay = min(self.config.DOWNLOAD_RETRY_BACKOFF * (2 ** (item.attempts - 1)), 60.0) * random.uniform(0.5, 1.5)
+    self.logger.log("Deferring retry of filename [%s] for %0.2f seconds, attempt [%d]" % (item.decoded_filename, delay, item.attempts))
+    return delay
+
+  # When retries are deferred, return True if the item may be attempted again
+  def candefer(self, item):
+    if self.config.DOWNLOAD_RETRY_BACKOFF <= 0 or stopped.is_set(): return False
+    if item.attempts + 1 >= max(1, self.retry): return False
+    item.attempts += 1
+    return True
+
+  def geturl(self, item, retry=None):
+    PDRETRY = self.retry if retry is None else retry
 
     # Call Files.PrepareDownload. If failure, retry up to retry times, waiting a short
     # interval between each attempt.
+    item.unavailable = False
     url = self.json.getDownloadURL(item.filename)
-    rowexists = True
 
     # If no URL, could be because thumbnail is missing but DB row exists - if thumbnail
     # no longer available, then delete the row and try again to obtain URL
-    if url is None and not self.config.DOWNLOAD_PREDELETE and item.dbid != 0 and self.force:
+    if url is None and not self.config.DOWNLOAD_PREDELETE and item.dbid != 0 and self.force and item.rowexists:
       if self.config.HAS_THUMBNAILS_FS and not os.path.exists(self.config.getFilePath(item.cachedurl)):
         self.logger.log("Deleting row with missing image from cache - id [%d], cachedurl [%s] for filename [%s]"
                       % (item.dbid, item.cachedurl, item.decoded_filename))
         self.database.deleteItem(item.dbid, None)
-        rowexists = False
+        self.totals.bump("Deleted", item.itype)
+        item.rowexists = False
 
     # If DOWNLOAD_PRIME is enabled, request the remote URL directly. If not available, don't bother
     # retrying call to Files.PrepareDownload as it will surely fail.
     if PDRETRY > 0 and url is None and self.config.DOWNLOAD_PRIME:
-      isAvailable = self.prime_the_request(item.decoded_filename)
+      isAvailable = self.isavailable(item)
     else:
       isAvailable  = True
 
@@ -1149,10 +2048,58 @@ class MyImageLoader(threading.Thread):
       PDRETRY -= 1
       url = self.json.getDownloadURL(item.filename)
 
-    return (url, rowexists)
+    if url is None and self.json.PREPAREDL_REFUSED:
+      item.unavailable = True
+
+    return (url, item.rowexists)
+
+  # Resolve the download URL for an item, returning (url, islocal)
+  def prepareImage(self, item, deferred):
+    url = self.getlocalurl(item)
+    if url is not None:
+      return (url, True)
+
+    (url, rowexists) = self.geturl(item, retry=(0 if deferred else None))
+    return (url, False)
+
+  # Return a locally built download URL, or None if local URLs are disabled or not possible.
+  # The first few local URLs are checked against Files.PrepareDownload.
+  def getlocalurl(self, item):
+    if not self.config.DOWNLOAD_LOCALURL: return None
+
+    url = self.json.getLocalDownloadURL(item.filename)
+    if url is None: return None
+
+    with lock:
+      check = (self.config.localurl_checked < self.config.DOWNLOAD_LOCALURL_CHECK)
+      if check: self.config.localurl_checked += 1
+
+    if check:
+      pdurl = self.json.getDownloadURL(item.filename)
+      if pdurl is not None and pdurl != url:
+        self.disablelocalurl(url, pdurl)
+        return None
+
+    return url
+
+  def disablelocalurl(self, url, pdurl):
+    with lock:
+      if self.config.DOWNLOAD_LOCALURL:
+        self.config.DOWNLOAD_LOCALURL = False
+        self.logger.log("Local download URL [%s] differs from Files.PrepareDownload URL [%s] - disabling local URLs" % (url, pdurl))
+
+  # Prime the request for remote artwork, noting when the artwork is known to be
+  # unavailable - a client error, rather than a timeout or server problem
+  def isavailable(self, item):
+    isAvailable = self.prime_the_request(item.decoded_filename)
+    status = self.primed_status
+    if not isAvailable and status is not None and 400 <= status < 500 and status not in [httplib.REQUEST_TIMEOUT, 429]:
+      item.unavailable = True
+    return isAvailable
 
   # Directly request the remote URL returning True if still available
   def prime_the_request(self, url):
+    self.primed_status = None
     if url is None: return False
 
     if url.startswith("http://"):
@@ -1171,19 +2118,87 @@ class MyImageLoader(threading.Thread):
       PAYLOAD = self.json.sendWeb("GET", page, "primeImage", headers={"User-agent": "Mozilla/5.0 (Windows NT 6.1; WOW64; rv:38.0) Gecko/20100101 Firefox/38.0"}, \
                                   readAmount=1024, rawData=True, domain=domain, useSSL=issecure)
       self.logger.log("Primed request of: HTTPS=%s, Domain [%s] with URL [%s], result [%d, %s]" % (issecure, domain, page, self.json.WEB_LAST_STATUS, self.json.WEB_LAST_REASON))
+      self.primed_status = self.json.WEB_LAST_STATUS
       isAvailable = (self.json.WEB_LAST_STATUS == 200 or 300 <= self.json.WEB_LAST_STATUS < 400)
     except:
       isAvailable = False
 
     return isAvailable
 
+  def canrevalidate(self, item):
+    return self.force and self.config.CACHE_REVALIDATE and item.dbid != 0 and item.rowexists
+
+  # Return True if remote artwork is unchanged since it was cached. Kodi hashes remote
+  # artwork as "d<mtime>s<size>" using the Last-Modified and Content-Length headers, so
+  # compare the hash with the headers returned by a conditional HEAD request.
+  def isunchanged(self, item):
+    url = item.decoded_filename
+    m = re.match("^(https?)://([^/]*)(.*)$", url or "")
+    hash = re.match("^d([0-9]+)s([0-9]+)$", item.imagehash or "")
+    if not m or not hash: return False
+
+    (scheme, domain, page) = m.groups()
+    headers = {"User-agent": "Mozilla/5.0 (Windows NT 6.1; WOW64; rv:38.0) Gecko/20100101 Firefox/38.0"}
+    if int(hash.group(1)) != 0:
+      headers["If-Modified-Since"] = email.utils.formatdate(int(hash.group(1)), usegmt=True)
+
+    try:
+      self.json.sendWeb("HEAD", page or "/", "revalidate", headers=headers, rawData=True, domain=domain, useSSL=(scheme == "https"))
+    except:
+      return False
+
+    status = self.json.WEB_LAST_STATUS
+    if status == httplib.NOT_MODIFIED:
+      unchanged = True
+    elif status == httplib.OK:
+      modified = email.utils.parsedate_tz(self.json.WEB_LAST_HEADERS.get("last-modified", ""))
+      mtime = email.utils.mktime_tz(modified) if modified else 0
+      size = self.json.WEB_LAST_HEADERS.get("content-length", "0")
+      unchanged = ("d%ss%s" % (mtime, size) == item.imagehash)
+    else:
+      unchanged = False
+
+    self.logger.log("Revalidated remote image, status [%d], hash [%s], unchanged [%s], filename [%s]" % (status, item.imagehash, unchanged, url))
+    return unchanged
+
+  # Account for the size of the image response (only the first 1KB is read, but Kodi
+  # still sends the whole image) against the bandwidth budgets
+  def chargeImage(self, item, payload):
+    try:
+      nbytes = int(self.json.WEB_LAST_HEADERS.get("content-length", len(payload)))
+    except ValueError:
+      nbytes = len(payload)
+    self.totals.addTransfer(nbytes)
+    self.work_queue.charge(item, nbytes)
+
+  # Returns True if cached, False if failed, or None when a failed attempt is to be
+  # retried later (only when download.retry.backoff is enabled).
   def loadImage(self, item):
-    ATTEMPT = 1 if self.retry < 1 else self.retry
+    deferred = (self.config.DOWNLOAD_RETRY_BACKOFF > 0)
+    ATTEMPT = 1 if self.retry < 1 or deferred else self.retry
     PERFORM_DOWNLOAD = False
 
     self.totals.start(item.mtype, item.itype)
 
-    (url, rowexists) = self.geturl(item)
+    # Keep the cached image when re-caching remote artwork that hasn't changed
+    if self.canrevalidate(item) and self.isunchanged(item):
+      self.totals.bump("Unchanged", item.itype)
+      self.totals.finish(item.mtype, item.itype)
+      return True
+
+    # Use the URL resolved by the prepare stage, if any
+    if item.prepared:
+      (url, islocal) = item.prepared
+      item.prepared = None
+    else:
+      (url, islocal) = self.prepareImage(item, deferred)
+    rowexists = item.rowexists
+
+    # Without a URL, retry later unless priming shows the remote image is no longer available
+    if url is None and deferred and (not self.config.DOWNLOAD_PRIME or self.isavailable(item)):
+      if self.candefer(item):
+        self.totals.finish(item.mtype, item.itype)
+        return None
 
     if url:
       if not self.config.DOWNLOAD_PREDELETE:
@@ -1192,7 +2207,8 @@ class MyImageLoader(threading.Thread):
             self.logger.log("Deleting old image from cache with id [%d], cachedurl [%s] for filename [%s]"
                             % (item.dbid, item.cachedurl, item.decoded_filename))
             self.database.deleteItem(item.dbid, item.cachedurl)
-          self.totals.bump("Deleted", item.itype)
+            self.totals.bump("Deleted", item.itype)
+            item.rowexists = False
           PERFORM_DOWNLOAD = True
       if self.config.DOWNLOAD_PAYLOAD or PERFORM_DOWNLOAD:
         self.logger.log("Proceeding with download of URL [%s]" % url)
@@ -1204,17 +2220,48 @@ class MyImageLoader(threading.Thread):
       try:
         # Don't need to download the whole image for it to be cached so just grab the first 1KB
         PAYLOAD = self.json.sendWeb("GET", url, "loadImage", readAmount=1024, rawData=True)
+        self.chargeImage(item, PAYLOAD)
         if self.json.WEB_LAST_STATUS == httplib.OK:
           self.logger.log("Successfully downloaded image with size [%d] bytes, attempts required [%d], filename [%s]" \
                         % (len(PAYLOAD), (self.retry - ATTEMPT + 1), item.decoded_filename))
           break
       except:
         pass
+
+      # If a locally built URL fails, call Files.PrepareDownload and try again with
+      # the URL it returns before counting this as a failed attempt
+      if islocal:
+        islocal = False
+        (pdurl, rowexists) = self.geturl(item, retry=(0 if deferred else None))
+        if pdurl is None:
+          self.logger.log("Image not available for download - uncacheable (embedded?), or doesn't exist. Filename [%s]" % item.filename)
+          ATTEMPT = 0
+          break
+        if pdurl != url:
+          self.disablelocalurl(url, pdurl)
+          url = pdurl
+          continue
+
       ATTEMPT -= 1
       self.logger.log("Failed to download image URL [%s], status [%d], " \
                    "attempts remaining [%d]" % (url, self.json.WEB_LAST_STATUS, ATTEMPT))
       if stopped.is_set(): ATTEMPT = 0
 
+    if ATTEMPT == 0 and deferred and url and self.candefer(item):
+      self.totals.finish(item.mtype, item.itype)
+      return None
+
+    # Remember permanent failures - artwork that Kodi or the remote site says is unavailable,
+    # or a client error status. Timeouts, an unresponsive Kodi and other failures could be
+    # transient so will be attempted again next time.
+    if ATTEMPT == 0 and not stopped.is_set():
+      status = self.json.WEB_LAST_STATUS
+      if not url:
+        if item.unavailable:
+          item.failure = "unavailable"
+      elif 400 <= status < 500 and status not in [httplib.REQUEST_TIMEOUT, 429]:
+        item.failure = "status %d" % status
+
     if ATTEMPT == 0:
       if not item.missingOK:
         self.totals.bump("Error", item.itype)
@@ -1225,6 +2272,38 @@ class MyImageLoader(threading.Thread):
 
     return ATTEMPT != 0
 
+#
+# Prepare stage of the download pipeline. Download URLs are resolved ahead of the
+# download threads, which only have to fetch the image. Items remain in flight with
+# the scheduler until downloaded, while a separate download slot limits concurrent
+# downloads per domain so that the next item can be prepared during a download.
+#
+class MyImagePreparer(MyImageLoader):
+  def __init__(self, work_queue, prepared_queue, config, logger, totals, force=False, retry=0):
+    MyImageLoader.__init__(self, work_queue, None, None, config, logger, totals, force, retry, prepared_queue)
+
+  def run(self):
+    deferred = (self.config.DOWNLOAD_RETRY_BACKOFF > 0)
+
+    with self.database:
+      while not stopped.is_set():
+        item = self.work_queue.get()
+        if item is None: break
+
+        # No point resolving a URL that won't be used - when revalidating, or the domain
+        # circuit breaker is open - leave it to the download thread
+        breaker = self.work_queue.getBreaker(item)
+        if not self.canrevalidate(item) and (breaker is None or breaker.remaining() == 0):
+          try:
+            item.prepared = self.prepareImage(item, deferred)
+          except IOEndOfReplayLog:
+            self.work_queue.done(item)
+            break
+
+        self.prepared_queue.put(item)
+
+    self.totals.stop()
+
 #
 # IMDB Thread
 #
@@ -1767,16 +2846,25 @@ class MyHDMIManager(threading.Thread):
 
     return ison
 
+# A texture cache row, whether loaded from SQLite or JSON
+MyTextureRow = collections.namedtuple("MyTextureRow", ["textureid", "cachedurl", "lasthashcheck", "url",
+                                                       "height", "width", "usecount", "lastused", "size", "imagehash"])
+
 #
 # Simple database wrapper class.
 #
 class MyDB(object):
-  def __init__(self, config, logger):
+  def __init__(self, config, logger, readonly=False):
     self.config = config
     self.logger = logger
 
     self.usejson = config.USEJSONDB
 
+    # Caller will only read from the database
+    self.readonly = readonly and config.DBREADONLY
+    self.snapshot = None
+    self.ownsnapshot = False
+
     #mydb will be either a SQL DB or MyJSONComms object
     self.mydb = None
 
@@ -1786,6 +2874,9 @@ class MyDB(object):
     self.RETRY_MAX = 10
     self.RETRY = 0
 
+    # Number of rows deleted by each statement (or JSON batch) in a bulk delete
+    self.DELETE_BATCH = 500
+
   def __enter__(self):
     self.getDB()
     return self
@@ -1795,6 +2886,21 @@ class MyDB(object):
     if self.mydb: self.mydb.close()
     self.cursor = self.mydb = None
 
+  def __del__(self):
+    self.removeSnapshot()
+
+  # A snapshot is reused by each connection (and clone) of this instance, so is
+  # only removed once the instance is discarded
+  def removeSnapshot(self):
+    if self.ownsnapshot:
+      MyDB.removeFile(self.snapshot)
+      self.snapshot = None
+      self.ownsnapshot = False
+
+  @staticmethod
+  def removeFile(filename):
+    if os.path.exists(filename): os.remove(filename)
+
   def getDB(self):
     if not self.mydb:
       if self.usejson:
@@ -1802,24 +2908,81 @@ class MyDB(object):
       else:
         if not os.path.exists(self.config.getDBPath()):
           raise lite.OperationalError("Database [%s] does not exist" % self.config.getDBPath())
-        self.mydb = lite.connect(self.config.getDBPath(), timeout=10)
+        self.mydb = self.connect(self.config.getDBPath())
         self.mydb.text_factory = lambda x: x.decode("iso-8859-1")
         self.DBVERSION = self.execute("SELECT idVersion FROM version").fetchone()[0]
     return self.mydb
 
-  def execute(self, SQL):
+  # Connect to the SQLite database. When only reading, use a read-only connection so
+  # that Kodi can't be blocked - or, with dbsnapshot, an immutable private copy of the
+  # database, which needs no locking at all. Read-only URI connections require Python 3.4+.
+  def connect(self, dbpath):
+    con = None
+
+    if self.readonly and sys.version_info >= (3, 4):
+      if self.config.DBSNAPSHOT and not self.snapshot:
+        self.snapshot = self.createSnapshot(dbpath)
+        self.ownsnapshot = (self.snapshot is not None)
+
+      if self.snapshot:
+        uri = "file:%s?immutable=1" % urllib2.pathname2url(self.snapshot)
+      else:
+        uri = "file:%s?mode=ro" % urllib2.pathname2url(dbpath)
+
+      try:
+        con = lite.connect(uri, timeout=10, uri=True)
+      except lite.OperationalError as e:
+        self.logger.log("Unable to open database read-only [%s], opening read-write: %s" % (uri, e))
+
+    if con is None:
+      con = lite.connect(dbpath, timeout=10)
+
+    if self.config.DBMMAP > 0:
+      con.execute("PRAGMA mmap_size = %d" % (self.config.DBMMAP * 1024 * 1024))
+    if self.config.DBCACHE > 0:
+      con.execute("PRAGMA cache_size = -%d" % (self.config.DBCACHE * 1024))
+
+    return con
+
+  # Copy the database to a temporary file using the SQLite backup API, which
+  # copies a consistent version of the database even while Kodi is writing to it
+  def createSnapshot(self, dbpath):
+    (fd, snapshot) = tempfile.mkstemp(prefix="texturecache_", suffix=".db")
+    os.close(fd)
+
+    self.logger.log("Creating database snapshot [%s] from [%s]" % (snapshot, dbpath))
+
+    source = target = None
+    try:
+      source = lite.connect(dbpath, timeout=10)
+      target = lite.connect(snapshot)
+      source.backup(target)
+    except (AttributeError, lite.Error) as e:
+      self.logger.log("Unable to create database snapshot: %s" % e)
+      os.remove(snapshot)
+      snapshot = None
+    finally:
+      if target: target.close()
+      if source: source.close()
+
+    # Don't leave the snapshot behind if this instance is never discarded
+    if snapshot: atexit.register(MyDB.removeFile, snapshot)
+
+    return snapshot
+
+  def execute(self, SQL, params=()):
     self.cursor = self.getDB().cursor()
     self.logger.log("EXECUTING SQL: %s" % SQL)
 
     try:
-      self.cursor.execute(SQL)
+      self.cursor.execute(SQL, params)
     except lite.OperationalError as e:
       if str(e) == "database is locked":
         if self.RETRY < self.RETRY_MAX:
           time.sleep(0.5 + (random.randint(10, 50)/100))
           self.RETRY += 1
           self.logger.log("EXCEPTION SQL: %s - retrying attempt #%d" % (e, self.RETRY))
-          self.execute(SQL)
+          self.execute(SQL, params)
         else:
           self.logger.out("ERROR: Database %s is locked - try again later." % self.config.getDBPath(), newLine=True, log=True)
           self.logger.out("", newLine=True)
@@ -1832,17 +2995,22 @@ class MyDB(object):
     return self.cursor
 
   def getRows(self, filter=None, order=None, allfields=False):
+    return list(self.iterRows(filter, order, allfields))
+
+  # Yield texture rows one at a time, as they are read from the cursor (or
+  # as each decoded JSON row is converted), rather than loading all rows
+  def iterRows(self, filter=None, order=None, allfields=False):
     if self.usejson:
       data = self.mydb.getTextures(filter, order, allfields)
       if "result" in data and "textures" in data["result"]:
-        funcNormalise = MyUtility.normalise
-        for r in data["result"]["textures"]:
-          r["url"] = funcNormalise(r["url"], strip=True)
-        return data["result"]["textures"]
-      else:
-        return []
+        textures = data["result"]["textures"]
+        data = None
+        textures.reverse()
+        while textures:
+          yield self._fromJSON(textures.pop())
     else:
-      return self._transform(self._getAllColumns(filter, order))
+      for r in self._getAllColumns(filter, order):
+        yield self._fromSQL(r)
 
   def getSingleRow(self, filter):
     rows = self.getRows(filter, allfields=True)
@@ -1851,33 +3019,74 @@ class MyDB(object):
     else:
       return None
 
-  def _getAllColumns(self, filter, order):
+  def _getAllColumnsSQL(self, extra=""):
     if self.DBVERSION >= 13:
-      SQL = "SELECT t.id, t.cachedurl, t.lasthashcheck, t.url, s.height, s.width, s.usecount, s.lastusetime, s.size, t.imagehash " \
-            "FROM texture t JOIN sizes s ON (t.id = s.idtexture)"
+      return "SELECT %st.id, t.cachedurl, t.lasthashcheck, t.url, s.height, s.width, s.usecount, s.lastusetime, s.size, t.imagehash " \
+             "FROM texture t JOIN sizes s ON (t.id = s.idtexture)" % extra
     else:
-      SQL = "SELECT t.id, t.cachedurl, t.lasthashcheck, t.url, 0 as height, 0 as width, t.usecount, t.lastusetime, 0 as size, t.imagehash " \
-            "FROM texture t"
+      return "SELECT %st.id, t.cachedurl, t.lasthashcheck, t.url, 0 as height, 0 as width, t.usecount, t.lastusetime, 0 as size, t.imagehash " \
+             "FROM texture t" % extra
+
+  def _getAllColumns(self, filter, order):
+    SQL = self._getAllColumnsSQL()
 
     if filter: SQL = "%s %s" % (SQL, filter)
     if order: SQL = "%s %s" % (SQL, order)
 
-    return self.execute(SQL).fetchall()
+    return self.execute(SQL)
 
-  # Return SQLite database rows as a dictionary list
-  # to match JSON equivalent
-  def _transform(self, rows):
-    data = []
-    funcNormalise = MyUtility.normalise
-    if rows:
-      for r in rows:
-        url = funcNormalise(r[3], strip=True)
-        data.append({u"textureid": r[0], u"cachedurl": r[1],
-                     u"lasthashcheck": r[2], u"url": url,
-                     u"sizes":[{u"height": r[4], u"width": r[5], u"usecount": r[6],
-                               u"lastused": r[7], u"size": r[8]}],
-                     u"imagehash": r[9]})
-    return data
+  # Match a list of normalised library URLs against the SQLite texture table, returning
+  # (index, row) tuples for the URLs that are present in the table.
+  #
+  # URLs are loaded into a temporary table and joined against the texture url index.
+  # Texture URLs that would be changed by normalisation (quoted, or image:// wrapped)
+  # can't be joined in this way, so are excluded from the join, then loaded and
+  # matched after normalisation, as would be the case without the join.
+  def matchRows(self, urls):
+    IRREGULAR = "(t.url LIKE 'image://%' OR t.url LIKE '%!%%' ESCAPE '!')"
+
+    self.execute("CREATE TEMP TABLE IF NOT EXISTS tc_match (idx INTEGER PRIMARY KEY, url TEXT)")
+    self.execute("DELETE FROM tc_match")
+    self.cursor.executemany("INSERT INTO tc_match (idx, url) VALUES (?, ?)", enumerate(urls))
+
+    matched = []
+    try:
+      SQL = self._getAllColumnsSQL(extra="m.idx, ")
+      SQL = "%s JOIN tc_match m ON (t.url = m.url) WHERE NOT %s" % (SQL, IRREGULAR)
+      for r in self.execute(SQL).fetchall():
+        matched.append((r[0], self._fromSQL(r[1:])))
+
+      rows = self.getRows("WHERE %s" % IRREGULAR)
+      if rows:
+        url_to_index = {}
+        for (idx, url) in enumerate(urls):
+          url_to_index.setdefault(url, []).append(idx)
+        for row in rows:
+          for idx in url_to_index.get(row.url, []):
+            matched.append((idx, row))
+    finally:
+      self.execute("DROP TABLE IF EXISTS tc_match")
+      self.commit()
+
+    return matched
+
+  # Convert SQLite and JSON rows to the equivalent MyTextureRow, with normalised url.
+  # Fields not requested from JSON (allfields=False) are None.
+  #
+  # SQLite text is decoded as iso-8859-1, so with Python 3 the url is first decoded
+  # as utf-8 (normalise does this with Python 2) to match library urls, and urls
+  # matched by the join in matchRows. This applies to every SQLite read, so urls
+  # output by x, s, p and orphan checks are also the same as with Python 2 and JSON.
+  def _fromSQL(self, r):
+    url = MyUtility.redecode(r[3]) if MyUtility.isPython3 and r[3] else r[3]
+    return MyTextureRow(r[0], r[1], r[2], MyUtility.normalise(url, strip=True), r[4], r[5], r[6], r[7], r[8], r[9])
+
+  def _fromJSON(self, r):
+    sizes = r.get("sizes", None)
+    s = sizes[0] if sizes else {}
+    return MyTextureRow(r["textureid"], r["cachedurl"], r.get("lasthashcheck", None), MyUtility.normalise(r["url"], strip=True),
+                        s.get("height", None), s.get("width", None), s.get("usecount", None), s.get("lastused", None),
+                        s.get("size", None), r.get("imagehash", None))
 
   def delRowByID(self, id):
     if id > 0:
@@ -1902,25 +3111,93 @@ class MyDB(object):
         self.logger.out("id %s is not valid\n" % (self.config.IDFORMAT % int(id)))
         return
       else:
-        localFile = row["cachedurl"]
+        localFile = row.cachedurl
     else:
       localFile = cachedURL
 
-    if localFile is not None and os.path.exists(self.config.getFilePath(localFile)):
+    if localFile is not None:
+      self.deleteFile(id, localFile, warnmissing)
+    elif warnmissing:
+      self.logger.out("WARNING: id %s, cached thumbnail file %s not found" % ((self.config.IDFORMAT % id), localFile), newLine=True)
+
+    self.delRowByID(id)
+
+  # Delete many rows, and the corresponding cached files, given a list of (id, cachedurl)
+  # tuples - cachedurl may be None, in which case it is taken from the row. Rows are deleted
+  # in batches, either within a single SQLite transaction, or as batched JSON requests.
+  def deleteItems(self, items, warnmissing=True):
+    items = [(id, cachedURL) for (id, cachedURL) in items if id > 0]
+
+    if self.usejson:
+      deleted = 0
+      for start in range(0, len(items), self.DELETE_BATCH):
+        batch = items[start:start + self.DELETE_BATCH]
+        requests = [{"method": "Textures.RemoveTexture", "params": {"textureid": id}} for (id, cachedURL) in batch]
+        for ((id, cachedURL), data) in zip(batch, self.getDB().sendJSONBatch(requests, "libTextures", checkResult=False)):
+          if "result" in data and data["result"] == "OK":
+            deleted += 1
+          else:
+            self.logger.out("id %s is not valid\n" % (self.config.IDFORMAT % int(id)))
+        self.logger.progress("Deleting rows %d of %d..." % (start + len(batch), len(items)))
+      self.logger.progress("")
+      return deleted
+
+    # Ignore ids that are no longer present
+    valid = {}
+    for start in range(0, len(items), self.DELETE_BATCH):
+      batch = [id for (id, cachedURL) in items[start:start + self.DELETE_BATCH]]
+      SQL = "SELECT id, cachedurl FROM texture WHERE id IN (%s)" % ",".join(["?"] * len(batch))
+      for r in self.execute(SQL, batch).fetchall():
+        valid[r[0]] = r[1]
+
+    ids = []
+    for (id, cachedURL) in items:
+      if id not in valid:
+        self.logger.out("id %s is not valid\n" % (self.config.IDFORMAT % int(id)))
+        continue
+      ids.append(id)
+      self.deleteFile(id, cachedURL if cachedURL is not None else valid[id], warnmissing)
+
+    try:
+      for start in range(0, len(ids), self.DELETE_BATCH):
+        batch = ids[start:start + self.DELETE_BATCH]
+        self.execute("DELETE FROM texture WHERE id IN (%s)" % ",".join(["?"] * len(batch)), batch)
+        self.logger.progress("Deleting rows %d of %d..." % (start + len(batch), len(ids)))
+      self.commit()
+    except:
+      self.getDB().rollback()
+      raise
+    finally:
+      self.logger.progress("")
+
+    return len(ids)
+
+  # Remove a cached file, and any corresponding DDS file
+  def deleteFile(self, id, localFile, warnmissing=True):
+    if os.path.exists(self.config.getFilePath(localFile)):
       os.remove(self.config.getFilePath(localFile))
       self.logger.log("FILE DELETE: Removed cached thumbnail file %s for id %s" % (localFile, (self.config.IDFORMAT % id)))
-    else:
-      if warnmissing:
-        self.logger.out("WARNING: id %s, cached thumbnail file %s not found" % ((self.config.IDFORMAT % id), localFile), newLine=True)
+    elif warnmissing:
+      self.logger.out("WARNING: id %s, cached thumbnail file %s not found" % ((self.config.IDFORMAT % id), localFile), newLine=True)
 
     # Check for any matching .dds file and remove that too
-    if localFile:
-      localFile_dds = "%s.dds" % os.path.splitext(localFile)[0]
-      if localFile_dds and os.path.exists(self.config.getFilePath(localFile_dds)):
-        os.remove(self.config.getFilePath(localFile_dds))
-        self.logger.log("FILE DELETE: Removed cached thumbnail file %s for id %s" % (localFile_dds, (self.config.IDFORMAT % id)))
+    localFile_dds = "%s.dds" % os.path.splitext(localFile)[0]
+    if os.path.exists(self.config.getFilePath(localFile_dds)):
+      os.remove(self.config.getFilePath(localFile_dds))
+      self.logger.log("FILE DELETE: Removed cached thumbnail file %s for id %s" % (localFile_dds, (self.config.IDFORMAT % id)))
 
-    self.delRowByID(id)
+  # Commit, retrying while the database is locked
+  def commit(self):
+    while True:
+      try:
+        self.getDB().commit()
+        break
+      except lite.OperationalError as e:
+        if str(e) != "database is locked" or self.RETRY >= self.RETRY_MAX: raise
+        time.sleep(0.5 + (random.randint(10, 50)/100))
+        self.RETRY += 1
+        self.logger.log("EXCEPTION SQL: %s - retrying commit attempt #%d" % (e, self.RETRY))
+    self.RETRY = 0
 
   def getRowByFilename(self, filename):
   # Strip image:// prefix, trailing / suffix, and unquote...
@@ -1959,14 +3236,14 @@ class MyDB(object):
 
   def dumpRow(self, row):
     line= ("%s%s%-14s%s%04d%s%04d%s%04d%s%19s%s%19s%s%s\n" % \
-           ((self.config.IDFORMAT % row["textureid"]),
-             self.config.FSEP, row["cachedurl"],
-             self.config.FSEP, row["sizes"][0]["height"],
-             self.config.FSEP, row["sizes"][0]["width"],
-             self.config.FSEP, row["sizes"][0]["usecount"],
-             self.config.FSEP, row["sizes"][0]["lastused"],
-             self.config.FSEP, row["lasthashcheck"],
-             self.config.FSEP, row["url"]))
+           ((self.config.IDFORMAT % row.textureid),
+             self.config.FSEP, row.cachedurl,
+             self.config.FSEP, row.height,
+             self.config.FSEP, row.width,
+             self.config.FSEP, row.usecount,
+             self.config.FSEP, row.lastused,
+             self.config.FSEP, row.lasthashcheck,
+             self.config.FSEP, row.url))
 
     self.logger.out(line)
 
@@ -1981,6 +3258,77 @@ class MyDB(object):
     else:
       return "WHERE cachedurl LIKE '%s/%%'" % folder
 
+  # Another connection to the same database (or snapshot), for use by another thread
+  def clone(self):
+    database = MyDB(self.config, self.logger, readonly=self.readonly)
+    database.snapshot = self.snapshot
+    return database
+
+  # Yield (folder, rows) for each texture cache folder, in folder order.
+  #
+  # With dbthreads > 1, folders are read in parallel by reader threads, each with
+  # its own connection, while the caller processes the rows of earlier folders.
+  # Readers stay no more than dbthreads folders ahead of the caller.
+  def iterTextureFolders(self, allfields=False):
+    folders = self.getTextureFolders()
+    THREADS = min(self.config.DBTHREADS, len(folders))
+
+    if THREADS <= 1:
+      for folder in folders:
+        yield (folder, self.iterRows(self.getTextureFolderFilter(folder), allfields=allfields))
+      return
+
+    cond = threading.Condition()
+    state = {"next": 0, "consumed": 0, "closed": False, "error": None}
+    results = {}
+
+    def reader():
+      try:
+        with self.clone() as database:
+          while True:
+            with cond:
+              while state["next"] < len(folders) and state["next"] >= state["consumed"] + THREADS and not state["closed"]:
+                cond.wait(0.5)
+              if state["next"] >= len(folders) or state["closed"]: break
+              fnum = state["next"]
+              state["next"] += 1
+
+            rows = database.getRows(database.getTextureFolderFilter(folders[fnum]), allfields=allfields)
+
+            with cond:
+              results[fnum] = rows
+              cond.notify_all()
+      except Exception as e:
+        with cond:
+          state["error"] = e
+          cond.notify_all()
+
+    threads = []
+    for i in range(THREADS):
+      t = threading.Thread(target=reader, name="DBReader%d" % i)
+      t.daemon = True
+      threads.append(t)
+      t.start()
+
+    try:
+      for fnum, folder in enumerate(folders):
+        with cond:
+          while fnum not in results and state["error"] is None and not stopped.is_set():
+            cond.wait(0.5)
+          if state["error"] is not None: raise state["error"]
+          if stopped.is_set(): break
+          rows = results.pop(fnum)
+          state["consumed"] = fnum + 1
+          cond.notify_all()
+
+        yield (folder, rows)
+    finally:
+      with cond:
+        state["closed"] = True
+        cond.notify_all()
+      for t in threads:
+        t.join()
+
 # Raise this exception when we run out of replay log input
 class IOEndOfReplayLog(Exception):
   def __init__(self, value):
@@ -1988,6 +3336,255 @@ class IOEndOfReplayLog(Exception):
   def __str__(self):
     return repr(self.value)
 
+#
+# Incrementally decode a stream of JSON messages received from a socket.
+#
+# Only newly received data is examined: strings are removed and the remaining
+# brackets counted to track nesting depth, so that buffered data is decoded
+# just once, when all messages in the buffer are complete.
+#
+class MyJSONDecoder(object):
+  def __init__(self, callback=None):
+    self.callback = callback
+    self.buffer = bytearray()
+    self.pos = 0
+    self.depth = 0
+    self.messages = []
+    self.lastsize = 0
+
+  # Add received data, decoding the buffer once all messages are complete
+  def feed(self, data):
+    buffer = self.buffer
+    buffer.extend(data)
+
+    # self.pos is never within a string, so escapes can be replaced before splitting on quotes
+    unscanned = bytes(buffer[self.pos:])
+    if b"\\" in unscanned:
+      unscanned = unscanned.replace(b"\\\\", b"__").replace(b"\\\"", b"__")
+
+    parts = unscanned.split(b"\"")
+    if len(parts) % 2 == 0:
+      # Resume from the start of the last string, as it's incomplete
+      self.pos += unscanned.rfind(b"\"")
+    else:
+      self.pos = len(buffer)
+
+    unquoted = b"".join(parts[0::2])
+    self.depth += unquoted.count(b"{") + unquoted.count(b"[") - unquoted.count(b"}") - unquoted.count(b"]")
+    del unscanned, parts, unquoted
+
+    if self.depth <= 0 and self.pos == len(buffer):
+      self.decode()
+
+  def decode(self):
+    try:
+      udata = self.buffer.decode("utf-8")
+    except UnicodeDecodeError:
+      udata = self.buffer.decode("utf-8", "ignore")
+
+    self.lastsize = len(self.buffer)
+    self.buffer = bytearray()
+    self.pos = self.depth = 0
+
+    _w = json.decoder.WHITESPACE.match
+    idx = _w(udata, 0).end()
+    end = len(udata)
+    if idx == end: return
+
+    if self.callback: self.callback(udata)
+
+    decoder = json._default_decoder
+    while idx != end:
+      (val, idx) = decoder.raw_decode(udata, idx)
+      self.messages.append(val)
+      idx = _w(udata, idx).end()
+
+  # True if a partial message has been received
+  def pending(self):
+    return len(self.buffer) != 0
+
+  # Return (and forget) all complete messages decoded so far
+  def __iter__(self):
+    messages = self.messages
+    self.messages = []
+    return iter(messages)
+
+#
+# A single RPC connection per Kodi host, shared by all threads.
+#
+# Requests are written by the calling thread, while a reader thread decodes
+# incoming data, passing each response to the queue of the thread waiting on
+# that request id, and each notification to the queue of every subscriber.
+#
+# Requests are sent with a unique id, which is replaced by the original id
+# when the response is received.
+#
+# Kodi responds to a request (or batch) that it can't parse with a null id.
+# Responses are received in the order requests are sent, so the waiters of
+# the oldest send still waiting are failed with that response.
+#
+class MyRPCConnection(object):
+  connections = {}
+  connections_lock = threading.Lock()
+
+  @staticmethod
+  def getConnection(config, logger, connecttimeout=None):
+    key = "%s:%s" % (config.KODI_HOST, config.RPC_PORT)
+    with MyRPCConnection.connections_lock:
+      connection = MyRPCConnection.connections.get(key, None)
+      if connection is None or connection.closed:
+        connection = MyRPCConnection(config, logger, connecttimeout)
+        MyRPCConnection.connections[key] = connection
+      return connection
+
+  def __init__(self, config, logger, connecttimeout=None):
+    self.config = config
+    self.logger = logger
+    self.lock = threading.Lock()
+    self.wlock = threading.Lock()
+    self.nextid = 0
+    self.waiters = {}
+    self.subscribers = []
+    self.closed = False
+
+    # Time data was last received, and whether a partial message has been received
+    self.lastio = time.time()
+    self.decoder = MyJSONDecoder()
+
+    self.socket = MyJSONComms.openSocket(config, logger, connecttimeout)
+
+    self.reader = threading.Thread(target=self.run, name="RPCReader")
+    self.reader.daemon = True
+    self.reader.start()
+
+  # Send a request, or a list of requests as a batch. Returns the queue on
+  # which responses (and optionally notifications) will be delivered, as a
+  # tuple of message and size. None will be delivered if the connection is closed.
+  def send(self, requests, notifications=False):
+    queue = Queue.Queue()
+    queue.wireids = []
+
+    wire = []
+    with self.lock:
+      if self.closed: raise IOError("RPC connection closed")
+      for request in (requests if isinstance(requests, list) else [requests]):
+        self.nextid += 1
+        wirerequest = dict(request)
+        wirerequest["id"] = "%s#%d" % (request["id"], self.nextid)
+        self.waiters[wirerequest["id"]] = (request["id"], queue, self.nextid)
+        queue.wireids.append(wirerequest["id"])
+        wire.append(wirerequest)
+      if notifications:
+        self.subscribers.append(queue)
+
+    data = json.dumps(wire if isinstance(requests, list) else wire[0])
+
+    try:
+      with self.wlock:
+        if MyUtility.isPython3:
+          self.socket.sendall(bytes(data, "utf-8"))
+        else:
+          self.socket.sendall(data)
+    except socket.error as e:
+      self.logger.log("RPC CONNECTION SEND FAILED: %s" % str(e))
+      self.close()
+
+    return queue
+
+  # Stop delivering responses and notifications to this queue
+  def cancel(self, queue):
+    with self.lock:
+      for wireid in queue.wireids:
+        self.waiters.pop(wireid, None)
+      if queue in self.subscribers:
+        self.subscribers.remove(queue)
+
+  def close(self):
+    with self.lock:
+      if self.closed: return
+      self.closed = True
+      queues = [w[1] for w in self.waiters.values()] + self.subscribers
+      self.waiters = {}
+      self.subscribers = []
+
+    try:
+      self.socket.shutdown(socket.SHUT_RDWR)
+      self.socket.close()
+    except socket.error:
+      pass
+
+    for queue in queues:
+      queue.put(None)
+
+  def run(self):
+    decoder = self.decoder
+    buffer = bytearray(32768)
+    view = memoryview(buffer)
+
+    try:
+      while not self.closed:
+        nbytes = self.socket.recv_into(buffer)
+        if nbytes == 0: break
+        self.lastio = time.time()
+        decoder.feed(view[:nbytes])
+        for m in decoder:
+          # Any null id response is processed once the rest of a batch response is delivered
+          rejected = None
+          for r in (m if isinstance(m, list) else [m]):
+            if "id" in r and r["id"] is None:
+              rejected = r
+            else:
+              self.dispatch(r, decoder.lastsize)
+          if rejected is not None:
+            self.reject(rejected, decoder.lastsize)
+    except Exception as e:
+      self.logger.log("RPC CONNECTION READER EXCEPTION: %s" % str(e))
+
+    self.logger.log("RPC CONNECTION CLOSED")
+    self.close()
+
+  # Deliver message, and size of the data from which it was decoded
+  def dispatch(self, message, size):
+    if "id" in message:
+      with self.lock:
+        waiter = self.waiters.pop(message["id"], None)
+      if waiter:
+        message["id"] = waiter[0]
+        waiter[1].put((message, size))
+      else:
+        self.logger.log("RPC CONNECTION IGNORING RESPONSE", jsonrequest=message, maxLen=256)
+    else:
+      with self.lock:
+        subscribers = list(self.subscribers)
+      for queue in subscribers:
+        queue.put((message, size))
+
+  # Deliver a null id response to every waiter of the oldest send still waiting
+  def reject(self, message, size):
+    with self.lock:
+      if self.waiters:
+        queue = min(self.waiters.values(), key=lambda w: w[2])[1]
+        rejected = [(wireid, w[0]) for (wireid, w) in self.waiters.items() if w[1] is queue]
+        for (wireid, reqid) in rejected:
+          del self.waiters[wireid]
+      else:
+        rejected = []
+
+    if rejected == []:
+      self.logger.log("RPC CONNECTION IGNORING RESPONSE", jsonrequest=message, maxLen=256)
+      return
+
+    self.logger.log("RPC CONNECTION REQUEST REJECTED", jsonrequest=message, maxLen=256)
+    for (wireid, reqid) in rejected:
+      m = dict(message)
+      m["id"] = reqid
+      queue.put((m, size))
+
+  # True if a response is being received, but no data has been received for timeout
+  # seconds since the later of the start time and the last data received
+  def stalled(self, start, timeout):
+    return self.decoder.pending() and (time.time() - max(start, self.lastio)) > timeout
+
 #
 # Handle all JSON RPC communication.
 #
@@ -2004,12 +3601,26 @@ class MyJSONComms(object):
     self.myweb = None
     self.WEB_LAST_STATUS = -1
     self.WEB_LAST_REASON = ""
-    self.config.WEB_SINGLESHOT = True
+    self.WEB_LAST_HEADERS = {}
+    # Kodi answered the last Files.PrepareDownload request with an error
+    self.PREPAREDL_REFUSED = False
     self.aUpdateCount = self.vUpdateCount = 0
     self.jcomms2 = None
 
     self.BUFFER_SIZE = 32768
 
+    # Read and discard the remainder of partially read web responses up to this size
+    # so that the connection can be reused, otherwise close the connection.
+    self.WEB_DRAIN_LIMIT = 16 * 1024 * 1024
+    # Number of failed web requests before switching to single shot mode
+    self.WEB_FAILURE_LIMIT = 3
+    self.BUFFER = bytearray(self.BUFFER_SIZE)
+    self.BUFFER_VIEW = memoryview(self.BUFFER)
+    self.LAST_RESPONSE_SIZE = 0
+
+    # Target maximum time to load a chunk, when adjusting chunk size
+    self.CHUNK_TIME = 5.0
+
     self.QUIT_METHOD = self.QUIT_PARAMS = None
 
     self.LOG_REPLAYFILE = None
@@ -2028,27 +3639,33 @@ class MyJSONComms(object):
     pass
 
   def getSocket(self):
-    lastexception = None
     if not self.mysocket:
-      useipv = int(self.config.RPC_IPVERSION) if self.config.RPC_IPVERSION else None
-      for ipversion in [socket.AF_INET6, socket.AF_INET]:
-        if useipv and useipv == 4 and ipversion != socket.AF_INET: continue
-        if useipv and useipv == 6 and ipversion != socket.AF_INET6: continue
-        try:
-          self.mysocket = socket.socket(ipversion, socket.SOCK_STREAM)
-          self.mysocket.settimeout(self.connecttimeout)
-          self.mysocket.connect((self.config.KODI_HOST, int(self.config.RPC_PORT)))
-          self.mysocket.settimeout(None)
-          self.logger.log("RPC connection established with IPv%s" % ("4" if ipversion == socket.AF_INET else "6"))
-          self.config.RPC_IPVERSION = "4" if ipversion == socket.AF_INET else "6"
-          return self.mysocket
-        except Exception as e:
-          lastexception = e
-          pass
-      else:
-        raise lastexception if lastexception is not None else socket.error("Unknown socket error")
+      self.mysocket = MyJSONComms.openSocket(self.config, self.logger, self.connecttimeout)
     return self.mysocket
 
+  # Connect to the RPC port, trying IPv6 then IPv4 unless the IP version
+  # is configured (or has been determined by an earlier connection).
+  @staticmethod
+  def openSocket(config, logger, connecttimeout=None):
+    lastexception = None
+    useipv = int(config.RPC_IPVERSION) if config.RPC_IPVERSION else None
+    for ipversion in [socket.AF_INET6, socket.AF_INET]:
+      if useipv and useipv == 4 and ipversion != socket.AF_INET: continue
+      if useipv and useipv == 6 and ipversion != socket.AF_INET6: continue
+      try:
+        mysocket = socket.socket(ipversion, socket.SOCK_STREAM)
+        mysocket.settimeout(connecttimeout)
+        mysocket.connect((config.KODI_HOST, int(config.RPC_PORT)))
+        mysocket.settimeout(None)
+        logger.log("RPC connection established with IPv%s" % ("4" if ipversion == socket.AF_INET else "6"))
+        config.RPC_IPVERSION = "4" if ipversion == socket.AF_INET else "6"
+        return mysocket
+      except Exception as e:
+        lastexception = e
+        pass
+    else:
+      raise lastexception if lastexception is not None else socket.error("Unknown socket error")
+
   # Use a secondary socket object for simple lookups to avoid having to handle
   # re-entrant code due to notifications being received out of sequence etc.
   # Could instantiate an object whenever required, but keeping a reference here
@@ -2059,6 +3676,11 @@ class MyJSONComms(object):
     return self.jcomms2
 
   def getWeb(self):
+    # Before reusing an idle connection, check it hasn't been closed by the server
+    if self.myweb and not self.config.WEB_SINGLESHOT and not self.isWebConnected(self.myweb):
+      self.logger.log("WEB CONNECTION CLOSED BY SERVER - RECONNECTING")
+      self.myweb.close()
+
     if not self.myweb or self.config.WEB_SINGLESHOT:
       if self.myweb: self.myweb.close()
       self.myweb = httplib.HTTPConnection("%s:%s" % (self.config.KODI_HOST, self.config.WEB_PORT), timeout=self.connecttimeout)
@@ -2067,6 +3689,41 @@ class MyJSONComms(object):
       if self.config.DEBUG: self.myweb.set_debuglevel(1)
     return self.myweb
 
+  # An idle connection is no longer usable if it has been closed (or there is
+  # unexpected data to be read), in which case the socket will be readable.
+  def isWebConnected(self, web):
+    if web.sock is None: return True
+    try:
+      (r, w, x) = select.select([web.sock], [], [], 0)
+      return r == []
+    except (select.error, socket.error, ValueError):
+      return False
+
+  # A connection can only be reused once the response has been read in full, so read
+  # and discard the remainder of a partially read response (such as an image, when only
+  # the first block is required) unless it is very large, otherwise close the connection.
+  def finishWebResponse(self, web, response):
+    if response.isclosed(): return
+    if self.config.WEB_SINGLESHOT or (response.length is not None and response.length > self.WEB_DRAIN_LIMIT):
+      web.close()
+      return
+
+    drained = 0
+    while drained <= self.WEB_DRAIN_LIMIT:
+      block = response.read(self.BUFFER_SIZE)
+      if not block: return
+      drained += len(block)
+
+    web.close()
+
+  # Switch to single shot mode once there have been too many failed requests
+  def webFailure(self):
+    with lock:
+      self.config.web_failures += 1
+      if self.config.web_failures >= self.WEB_FAILURE_LIMIT and not self.config.WEB_SINGLESHOT:
+        self.logger.log("SWITCHING TO WEBSERVER.SINGLESHOT MODE")
+        self.config.WEB_SINGLESHOT = True
+
   def logreplay_open(self):
     try:
       thread = threading.current_thread().name
@@ -2134,7 +3791,7 @@ class MyJSONComms(object):
     self.LOG_REPLAYFILE.close()
     raise IOEndOfReplayLog("End of replay log data")
 
-  def sendWeb(self, request_type, url, id, request=None, headers={}, readAmount=0, timeout=15.0, rawData=False, domain=None, useSSL=False):
+  def sendWeb(self, request_type, url, id, request=None, headers={}, readAmount=0, timeout=15.0, rawData=False, domain=None, useSSL=False, reconnect=True):
     if request is not None:
       sdata = json.dumps(request)
       self.logger.log("%s.JSON WEB REQUEST: [%s] [%s]" % (id, request_type, sdata))
@@ -2161,17 +3818,24 @@ class MyJSONComms(object):
           headers.update({"Authorization": "Basic %s" % self.config.WEB_AUTH_TOKEN})
         web = self.getWeb()
 
-      web.request(request_type, url, sdata, headers)
-
-      if timeout is None: web.sock.setblocking(1)
-      else: web.sock.settimeout(timeout)
-
+      # Failure of a request on a connection that has been used before is likely due
+      # to the connection having been closed, so may be retried on a new connection
+      reused = (web.sock is not None)
+      self.WEB_LAST_STATUS = -1
+      self.WEB_LAST_REASON = ""
+      self.WEB_LAST_HEADERS = {}
       data = ""
 
       try:
+        web.request(request_type, url, sdata, headers)
+
+        if timeout is None: web.sock.setblocking(1)
+        else: web.sock.settimeout(timeout)
+
         response = web.getresponse()
         self.WEB_LAST_STATUS = response.status
         self.WEB_LAST_REASON = response.reason
+        self.WEB_LAST_HEADERS = dict([(k.lower(), v) for (k, v) in response.getheaders()])
 
         if self.WEB_LAST_STATUS == httplib.UNAUTHORIZED:
           raise httplib.HTTPException("Remote web host requires webserver.username/webserver.password properties")
@@ -2186,23 +3850,32 @@ class MyJSONComms(object):
             data = response.read()
           else:
             data = response.read(readAmount)
+
+        if not domain:
+          self.finishWebResponse(web, response)
       except socket.timeout:
         self.logger.log("** iotimeout occurred during web request **")
+        # Only timeouts of the Kodi web server indicate that Kodi is overloaded
+        if not domain:
+          with lock:
+            self.config.web_timeouts += 1
         self.WEB_LAST_STATUS = httplib.REQUEST_TIMEOUT
         self.WEB_LAST_REASON = "Request Timeout"
-        self.myweb.close()
-        self.myweb = None
+        web.close()
+        if not domain: self.myweb = None
         data = ""
       except:
         if domain:
-          self.logger.log("%s.RECEIVED WEB DATA: %d, %s, <exception>" % (id, response.status, response.reason), maxLen=256)
+          self.logger.log("%s.RECEIVED WEB DATA: %d, %s, <exception>" % (id, self.WEB_LAST_STATUS, self.WEB_LAST_REASON), maxLen=256)
           raise
-        if self.config.WEB_SINGLESHOT == False:
-          self.logger.log("SWITCHING TO WEBSERVER.SINGLESHOT MODE")
-          self.config.WEB_SINGLESHOT = True
-          data = self.sendWeb(request_type, url, id, request, headers, readAmount, timeout, rawData)
-        else:
+        web.close()
+        if self.WEB_LAST_STATUS == httplib.UNAUTHORIZED:
           raise
+        if reused and reconnect and not self.config.WEB_SINGLESHOT:
+          self.logger.log("WEB CONNECTION FAILED - RETRYING WITH NEW CONNECTION")
+          return self.sendWeb(request_type, url, id, request, headers, readAmount, timeout, rawData, reconnect=False)
+        self.webFailure()
+        raise
       finally:
         if domain and web:
           web.close()
@@ -2232,6 +3905,9 @@ class MyJSONComms(object):
     self.logger.log("%s.JSON SOCKET REQUEST:" % id, jsonrequest=request)
     START_IO_TIME = time.time()
 
+    if self.config.RPC_SHARED and not self.config.LOG_REPLAY_FILENAME:
+      return self.sendJSONShared(request, id, callback, timeout, checkResult, ignoreSocketError, START_IO_TIME)
+
     if self.config.LOG_REPLAY_FILENAME:
       jsocket = None
     else:
@@ -2241,31 +3917,14 @@ class MyJSONComms(object):
       else:
         jsocket.send(json.dumps(request))
 
-    ENDOFDATA = True
-    LASTIO = 0
+    reader = self.readJSON(jsocket, request, id, timeout, useWebServer)
     jdata = {}
     cbjdata = None
 
     while True:
-      if ENDOFDATA:
-        ENDOFDATA = False
-        data = b""
-        if jsocket: jsocket.setblocking(1)
-
       try:
-        if jsocket:
-          newdata = jsocket.recv(self.BUFFER_SIZE)
-          if len(data) == 0: jsocket.settimeout(1.0)
-        else:
-          newdata = self.logreplay(request, useWebServer)
-
-        data += newdata
-        LASTIO = time.time()
-        self.logger.log("%s.BUFFER RECEIVED (len %d)" % (id, len(newdata)))
-        if len(newdata) == 0: raise IOError("nodata")
-        READ_ERR = False
-
-      except (IOError, IOEndOfReplayLog) as e:
+        messages = next(reader)
+      except (IOError, IOEndOfReplayLog):
         # Hack to exit monitor mode when socket dies
         if callback:
           jdata = {"jsonrpc":"2.0","method":"System.OnQuit","params":{"data":-1,"sender":"xbmc"}}
@@ -2277,134 +3936,325 @@ class MyJSONComms(object):
         else:
           return {}
 
-      except socket.error as e:
-        READ_ERR = True
+      try:
+        # Process any notifications first.
+        # Any message with an id must be processed after notification - should only be one at most...
+        result = False
+        jdata = {}
+        for m in messages:
+          if "id" not in m:
+            if callback:
+              if self.handleResponse(id, m, callback):
+                result = True
+            elif self.logger.LOGGING:
+              self.logger.log("%s.IGNORING NOTIFICATION" % id, jsonrequest=m, maxLen=256)
+          elif m["id"] == id:
+            jdata = m
+
+        # Discard - no longer required
+        del messages
+
+        # "result" on response for an Application.SetMute()/SetVolume() is
+        # not iterable so just ignore it if we cause an exception...
+        try:
+          if ("result" in jdata and "limits" in jdata["result"]):
+            self.logger.log("%s.RECEIVED LIMITS: %s" % (id, jdata["result"]["limits"]))
+        except TypeError:
+          pass
 
-      # Keep reading unless accumulated data is a likely candidate for successful parsing...
-      if not READ_ERR and len(data) != 0 and (data[-1:] == b"}" or data[-2:] == b"}\n"):
+        # callback result for a commingled Notification - stop blocking/reading and
+        # return to caller with response (jdata)
+        if result: break
 
-        # If data is not a str (Python2) then decode Python3 bytes to Unicode representation
-        if isinstance(data, str):
-          udata = MyUtility.toUnicode(data)
+        # Got a response...
+        if jdata != {}:
+          # If callback defined, pass it the message then break if result is True.
+          # Otherwise break only if message has an id, that is to
+          # say, continue reading data (blocking) until a message (response)
+          # with an id is available.
+          if callback:
+            if self.handleResponse(id, jdata, callback): break
+            #Save this jdata as it's our original response
+            if cbjdata is None: cbjdata = jdata
+          elif "id" in jdata:
+            break
+
+        if callback:
+          self.logger.log("%s.READING SOCKET UNTIL CALLBACK SUCCEEDS..." % id)
         else:
-          try:
-            udata = data.decode("utf-8")
-          except UnicodeDecodeError as e:
-            udata = data
+          self.logger.log("%s.READING SOCKET FOR A RESPONSE..." % id)
 
-        try:
-          START_PARSE_TIME = time.time()
-
-          # Parse messages, to ensure the entire buffer is valid
-          # If buffer is not valid (VlueError exception), we may need to read more data.
-          messages = []
-          for m in self.parseResponse(udata):
-            if self.logger.LOGGING and messages == []:
-              if udata.find("\n") != -1:
-                self.logger.log2("%s.PARSING JSON DATA: " % id, udata.replace("\t", "").replace("\n", ""), maxLen=256)
-              else:
-                self.logger.log2("%s.PARSING JSON DATA: " % id, udata, maxLen=256)
-            messages.append(m)
+      except Exception as e:
+        self.logger.log("%s.GENERAL EXCEPTION: %s" % (id, str(e)))
+        raise
 
-          # Discard these buffers which could potentially be very large, as they're no longer required
-          del data, udata
+    if cbjdata is not None: jdata = cbjdata
+    if checkResult and not "result" in jdata:
+      self.logger.out("%s.ERROR: JSON response has no result!\n%s\n" % (id, jdata))
 
-          self.logger.log("%s.PARSING COMPLETE, elapsed time: %f seconds" % (id, time.time() - START_PARSE_TIME))
+    self.logger.log("%s.FINISHED, elapsed time: %f seconds" % (id, time.time() - START_IO_TIME))
+    return jdata
 
-          # Process any notifications first.
-          # Any message with an id must be processed after notification - should only be one at most...
-          result = False
-          jdata = {}
-          for m in messages:
-            if "id" not in m:
-              if callback:
-                if self.handleResponse(id, m, callback):
-                  result = True
-              elif self.logger.LOGGING:
-                self.logger.log("%s.IGNORING NOTIFICATION" % id, jsonrequest=m, maxLen=256)
-            elif m["id"] == id:
-              jdata = m
-
-          # Discard - no longer required
-          del messages
+  # Read the socket (or log replay), yielding each list of complete messages as it's
+  # received, for as long as the caller needs more responses. Raises IOError when the
+  # socket is closed, and socket.error when a partially received response times out.
+  def readJSON(self, jsocket, request, id, timeout=5.0, useWebServer=False):
+    decoder = MyJSONDecoder(callback=lambda udata: self.logJSONData(id, udata))
+    ENDOFDATA = True
+    LASTIO = time.time()
 
-          # "result" on response for an Application.SetMute()/SetVolume() is
-          # not iterable so just ignore it if we cause an exception...
-          try:
-            if ("result" in jdata and "limits" in jdata["result"]):
-              self.logger.log("%s.RECEIVED LIMITS: %s" % (id, jdata["result"]["limits"]))
-          except TypeError:
-            pass
+    while True:
+      if ENDOFDATA:
+        ENDOFDATA = False
+        if jsocket: jsocket.setblocking(1)
 
-          # Flag to reset buffers next time we read the socket.
-          ENDOFDATA = True
+      try:
+        if jsocket:
+          nbytes = jsocket.recv_into(self.BUFFER)
+          if not decoder.pending(): jsocket.settimeout(1.0)
+          newdata = self.BUFFER_VIEW[:nbytes]
+        else:
+          newdata = self.logreplay(request, useWebServer)
+          nbytes = len(newdata)
 
-          # callback result for a commingled Notification - stop blocking/reading and
-          # return to caller with response (jdata)
-          if result: break
+        LASTIO = time.time()
+        self.logger.log("%s.BUFFER RECEIVED (len %d)" % (id, nbytes))
+        if nbytes == 0: raise IOError("nodata")
+        READ_ERR = False
 
-          # Got a response...
-          if jdata != {}:
-            # If callback defined, pass it the message then break if result is True.
-            # Otherwise break only if message has an id, that is to
-            # say, continue reading data (blocking) until a message (response)
-            # with an id is available.
-            if callback:
-              if self.handleResponse(id, jdata, callback): break
-              #Save this jdata as it's our original response
-              if cbjdata is None: cbjdata = jdata
-            elif "id" in jdata:
-              break
+      except (IOError, IOEndOfReplayLog):
+        raise
 
-          if callback:
-            self.logger.log("%s.READING SOCKET UNTIL CALLBACK SUCCEEDS..." % id)
-          else:
-            self.logger.log("%s.READING SOCKET FOR A RESPONSE..." % id)
+      except socket.error:
+        READ_ERR = True
 
+      if not READ_ERR:
+        START_PARSE_TIME = time.time()
+
+        try:
+          decoder.feed(newdata)
         except ValueError as e:
-          # If we think we've reached EOF (no more data) and we have invalid data then
-          # raise exception,  otherwise continue reading more data
-          if READ_ERR:
-            self.logger.log("%s.VALUE ERROR EXCEPTION: %s" % (id, str(e)))
-            raise
-          else:
-            self.logger.log("%s.Incomplete JSON data - continue reading socket" % id)
-            if self.logger.VERBOSE: self.logger.log2("Ignored Value Error: ", str(e))
-            continue
+          self.logger.log("%s.VALUE ERROR EXCEPTION: %s" % (id, str(e)))
+          raise
         except Exception as e:
           self.logger.log("%s.GENERAL EXCEPTION: %s" % (id, str(e)))
           raise
 
-      # Still more data to be read...
-      if not ENDOFDATA:
-        if (time.time() - LASTIO) > timeout:
-          self.logger.log("SOCKET IO TIMEOUT EXCEEDED")
-          raise socket.error("Socket IO timeout exceeded")
+        # Messages are only available once the accumulated data is complete,
+        # otherwise continue reading more data
+        messages = list(decoder)
+        if messages == []:
+          self.logger.log("%s.Incomplete JSON data - continue reading socket" % id)
+        else:
+          self.LAST_RESPONSE_SIZE = decoder.lastsize
+          self.logger.log("%s.PARSING COMPLETE, elapsed time: %f seconds" % (id, time.time() - START_PARSE_TIME))
+
+          # Flag to reset socket blocking next time we read the socket.
+          ENDOFDATA = True
+          yield messages
+          del messages
+
+      # Still more data to be read...
+      if not ENDOFDATA:
+        if (time.time() - LASTIO) > timeout:
+          self.logger.log("SOCKET IO TIMEOUT EXCEEDED")
+          raise socket.error("Socket IO timeout exceeded")
+
+  # As sendJSON(), but using the RPC connection shared by all threads. Responses, and
+  # notifications when there is a callback, are received from the connection reader thread.
+  def sendJSONShared(self, request, id, callback, timeout, checkResult, ignoreSocketError, START_IO_TIME):
+    connection = MyRPCConnection.getConnection(self.config, self.logger, self.connecttimeout)
+    responses = connection.send(request, notifications=(callback is not None))
+    return self.receiveJSONShared(connection, responses, id, callback, timeout, checkResult, ignoreSocketError, START_IO_TIME)
+
+  # Wait for the response to a request sent on the shared RPC connection
+  def receiveJSONShared(self, connection, responses, id, callback=None, timeout=5.0, checkResult=True, ignoreSocketError=False, START_IO_TIME=None):
+    jdata = {}
+    cbjdata = None
+
+    try:
+      while True:
+        (m, size) = self.getShared(connection, responses, timeout)
+        if self.logger.LOGGING: self.logJSONData(id, json.dumps(m))
+
+        if "id" not in m:
+          if callback:
+            # callback result for a commingled Notification - stop waiting and
+            # return to caller with response (jdata)
+            if self.handleResponse(id, m, callback): break
+          elif self.logger.LOGGING:
+            self.logger.log("%s.IGNORING NOTIFICATION" % id, jsonrequest=m, maxLen=256)
+          continue
+
+        jdata = m
+        self.LAST_RESPONSE_SIZE = size
+
+        try:
+          if ("result" in jdata and "limits" in jdata["result"]):
+            self.logger.log("%s.RECEIVED LIMITS: %s" % (id, jdata["result"]["limits"]))
+        except TypeError:
+          pass
+
+        if not callback: break
+        if self.handleResponse(id, jdata, callback): break
+        if cbjdata is None: cbjdata = jdata
+        self.logger.log("%s.WAITING UNTIL CALLBACK SUCCEEDS..." % id)
+
+    except socket.timeout:
+      raise
+    except IOError:
+      # Hack to exit monitor mode when socket dies
+      if callback:
+        jdata = {"jsonrpc":"2.0","method":"System.OnQuit","params":{"data":-1,"sender":"xbmc"}}
+        self.handleResponse(id, jdata, callback)
+        return jdata
+      elif ignoreSocketError == False and not stopped.is_set():
+        self.logger.err("ERROR: Socket closed prematurely - exiting", newLine=True, log=True)
+        sys.exit(2)
+      else:
+        return {}
+    finally:
+      connection.cancel(responses)
+
+    if cbjdata is not None: jdata = cbjdata
+    if checkResult and not "result" in jdata:
+      self.logger.out("%s.ERROR: JSON response has no result!\n%s\n" % (id, jdata))
+
+    if START_IO_TIME is not None:
+      self.logger.log("%s.FINISHED, elapsed time: %f seconds" % (id, time.time() - START_IO_TIME))
+    return jdata
+
+  # Send a list of requests as JSON-RPC batches, each batch of up to rpc.batchsize
+  # requests being sent with a single write. Every request is given a unique id
+  # (id.n) so that responses can be returned in the same order as the requests,
+  # regardless of the order in which they are received.
+  def sendJSONBatch(self, requests, id, timeout=5.0, checkResult=True):
+    BATCH_SIZE = self.config.RPC_BATCHSIZE
+
+    if BATCH_SIZE <= 1:
+      return [self.sendJSON(request, id, timeout=timeout, checkResult=checkResult) for request in requests]
+
+    results = []
+    for start in range(0, len(requests), BATCH_SIZE):
+      batch = requests[start:start + BATCH_SIZE]
+      for (n, request) in enumerate(batch):
+        request["jsonrpc"] = "2.0"
+        request["id"] = "%s.%d" % (id, start + n)
+
+      responses = self.sendJSONBatchChunk(batch, id, timeout)
+
+      for request in batch:
+        jdata = responses.get(request["id"], {})
+        if checkResult and not "result" in jdata:
+          self.logger.out("%s.ERROR: JSON response has no result!\n%s\n" % (request["id"], jdata))
+        results.append(jdata)
+
+    return results
+
+  # Send a single batch, and read the socket until every request in the batch has a
+  # response. Returns a dict of responses keyed by request id.
+  def sendJSONBatchChunk(self, batch, id, timeout=5.0):
+    self.logger.log("%s.JSON SOCKET BATCH REQUEST (%d requests):" % (id, len(batch)), jsonrequest=batch)
+    START_IO_TIME = time.time()
+
+    if self.config.RPC_SHARED and not self.config.LOG_REPLAY_FILENAME:
+      return self.sendJSONBatchShared(batch, id, timeout, START_IO_TIME)
+
+    if self.config.LOG_REPLAY_FILENAME:
+      jsocket = None
+    else:
+      jsocket = self.getSocket()
+      jsocket.setblocking(1)
+      if MyUtility.isPython3:
+        jsocket.sendall(bytes(json.dumps(batch), "utf-8"))
+      else:
+        jsocket.sendall(json.dumps(batch))
+
+    reader = self.readJSON(jsocket, batch, id, timeout)
+    pending = set([request["id"] for request in batch])
+    responses = {}
+
+    while pending:
+      try:
+        messages = next(reader)
+      except (IOError, IOEndOfReplayLog):
+        self.logger.err("ERROR: Socket closed prematurely - exiting", newLine=True, log=True)
+        sys.exit(2)
+
+      # A batch response is an array, but notifications may also be received
+      for m in messages:
+        for r in (m if isinstance(m, list) else [m]):
+          if "id" not in r:
+            if self.logger.LOGGING:
+              self.logger.log("%s.IGNORING NOTIFICATION" % id, jsonrequest=r, maxLen=256)
+          elif r["id"] in pending:
+            pending.remove(r["id"])
+            responses[r["id"]] = r
+          elif r["id"] is None:
+            # The batch as a whole has been rejected, so no further responses will follow
+            self.logger.log("%s.BATCH REJECTED" % id, jsonrequest=r, maxLen=256)
+            for reqid in pending: responses[reqid] = r
+            pending = set()
+
+      del messages
+
+      if pending:
+        self.logger.log("%s.READING SOCKET FOR %d MORE RESPONSES..." % (id, len(pending)))
+
+    self.logger.log("%s.FINISHED, elapsed time: %f seconds" % (id, time.time() - START_IO_TIME))
+    return responses
+
+  def sendJSONBatchShared(self, batch, id, timeout, START_IO_TIME):
+    responses = {}
+    queue = None
 
-    if cbjdata is not None: jdata = cbjdata
-    if checkResult and not "result" in jdata:
-      self.logger.out("%s.ERROR: JSON response has no result!\n%s\n" % (id, jdata))
+    connection = MyRPCConnection.getConnection(self.config, self.logger, self.connecttimeout)
+
+    try:
+      queue = connection.send(batch)
+
+      while len(responses) < len(batch):
+        m = self.getShared(connection, queue, timeout)[0]
+        if self.logger.LOGGING: self.logJSONData(id, json.dumps(m))
+        responses[m["id"]] = m
+
+    except socket.timeout:
+      raise
+    except IOError:
+      if stopped.is_set(): return responses
+      self.logger.err("ERROR: Socket closed prematurely - exiting", newLine=True, log=True)
+      sys.exit(2)
+    finally:
+      if queue is not None: connection.cancel(queue)
 
     self.logger.log("%s.FINISHED, elapsed time: %f seconds" % (id, time.time() - START_IO_TIME))
-    return jdata
+    return responses
 
-  # Split data into individual JSON objects.
-  def parseResponse(self, data):
+  # Return the next (message, size) delivered to a queue of the shared RPC connection.
+  # As when reading a socket, the IO timeout applies once a response is being received.
+  def getShared(self, connection, queue, timeout):
+    START_IO_TIME = time.time()
 
-    decoder = json._default_decoder
-    _w=json.decoder.WHITESPACE.match
+    while True:
+      try:
+        item = queue.get(True, 1.0)
+      except Queue.Empty:
+        if stopped.is_set(): raise IOError("Stopped")
+        if not connection.reader.is_alive(): raise IOError("RPC connection reader has exited")
+        if connection.stalled(START_IO_TIME, timeout):
+          self.logger.log("SOCKET IO TIMEOUT EXCEEDED")
+          raise socket.timeout("Socket IO timeout exceeded")
+        continue
 
-    idx = _w(data, 0).end()
-    end = len(data)
+      if item is None: raise IOError("RPC connection closed")
+      return item
 
-    try:
-      while idx != end:
-        (val, idx) = decoder.raw_decode(data, idx=idx)
-        yield val
-        idx = _w(data, idx).end()
-    except ValueError as exc:
-#      raise ValueError("%s (%r at position %d)." % (exc, data[idx:], idx))
-      raise ValueError("%s" % exc)
+  def logJSONData(self, id, udata):
+    if self.logger.LOGGING:
+      if udata.find("\n") != -1:
+        self.logger.log2("%s.PARSING JSON DATA: " % id, udata.replace("\t", "").replace("\n", ""), maxLen=256)
+      else:
+        self.logger.log2("%s.PARSING JSON DATA: " % id, udata, maxLen=256)
 
   # Process Notifications, optionally executing a callback function for
   # additional custom processing.
@@ -2773,11 +4623,21 @@ class MyJSONComms(object):
 
     data = self.sendJSON(REQUEST, "preparedl")
 
+    self.PREPAREDL_REFUSED = ("error" in data)
+
     if "result" in data:
       return "/%s" % data["result"]["details"]["path"]
     else:
       return None
 
+  # Build the same URL that Files.PrepareDownload would return, without the round trip.
+  # Only image:// paths are handled, anything else returns None.
+  def getLocalDownloadURL(self, filename):
+    if filename and filename.startswith("image://"):
+      return "/image/%s" % MyUtility.kodiEncode(filename)
+    else:
+      return None
+
   # Get file details from a directory lookup, this prevents errors on Kodi when
   # the file doesn't exist (unless the directory doesn't exist), and also allows the
   # query results to be cached for use by subsequent file requests in the same directory.
@@ -2884,12 +4744,29 @@ class MyJSONComms(object):
     data = self.sendJSON(REQUEST, "libRemove", checkResult=True)
 
   def dumpJSON(self, data, decode=False, ensure_ascii=True):
+    if not isinstance(data, list):
+      return self.dumpJSONItems(data, decode, ensure_ascii)
+
     if decode:
       self.logger.progress("Decoding URLs...")
       self.unquoteArtwork(data)
     self.logger.progress("")
     self.logger.out(json.dumps(data, indent=2, ensure_ascii=ensure_ascii, sort_keys=True), newLine=True)
 
+  # Output items as they are yielded by a generator, formatted as if
+  # the entire list had been dumped by dumpJSON()
+  def dumpJSONItems(self, items, decode=False, ensure_ascii=True):
+    separator = None
+    for item in items:
+      if decode: self.unquoteArtwork([item])
+      text = json.dumps(item, indent=2, ensure_ascii=ensure_ascii, sort_keys=True).replace("\n", "\n  ")
+      self.logger.progress("")
+      self.logger.out("%s  %s" % ("[\n" if separator is None else separator, text))
+      separator = ",\n" if MyUtility.isPython3 else ", \n"
+
+    if separator is not None:
+      self.logger.out("\n]", newLine=True)
+
   def unquoteArtwork(self, items):
     for item in items:
       for field in item:
@@ -3018,7 +4895,25 @@ class MyJSONComms(object):
 
   def getData(self, action, mediatype,
               filter = None, useExtraFields = False, secondaryFields = None,
-              tvshow = None, tvseason = None, channelgroupid = None, lastRun = False, subType = None, uniquecast = None):
+              tvshow = None, tvseason = None, channelgroupid = None, lastRun = False, subType = None, uniquecast = None,
+              stream = False):
+
+    (SECTION, TITLE, IDENTIFIER, REQUEST) = self.getDataRequest(action, mediatype, filter, useExtraFields, secondaryFields,
+                                                                tvshow, tvseason, channelgroupid, lastRun, subType)
+
+    # Return a generator that yields items as each chunk is loaded
+    if stream and self.config.CHUNKED:
+      items = self.chunkedLoadItems(mediatype, REQUEST, trim_cast_thumbs=(action != "dump"),
+                                    idname="lib%s" % mediatype.capitalize(), uniquecast=uniquecast)
+      return (SECTION, TITLE, IDENTIFIER, {"result": {SECTION: items}})
+
+    return (SECTION, TITLE, IDENTIFIER,
+            self.getDataProxy(mediatype, REQUEST, trim_cast_thumbs=(action != "dump"), uniquecast=uniquecast))
+
+  # Build the request used by getData(), without sending it.
+  def getDataRequest(self, action, mediatype,
+                     filter = None, useExtraFields = False, secondaryFields = None,
+                     tvshow = None, tvseason = None, channelgroupid = None, lastRun = False, subType = None):
 
     EXTRA = mediatype
     SECTION = mediatype
@@ -3243,8 +5138,7 @@ class MyJSONComms(object):
           self.addProperties(REQUEST, "fanart")
           self.addProperties(REQUEST, "thumbnail")
 
-    return (SECTION, TITLE, IDENTIFIER,
-            self.getDataProxy(mediatype, REQUEST, trim_cast_thumbs=(action != "dump"), uniquecast=uniquecast))
+    return (SECTION, TITLE, IDENTIFIER, REQUEST)
 
   # Load data chunked, or in one single query.
   # TV Shows, seasons and episodes are already "chunked" by definition.
@@ -3268,9 +5162,87 @@ class MyJSONComms(object):
 
     return data
 
+  # Load data for a list of requests using JSON-RPC batches, returning a list of responses
+  # in request order. Only suitable for requests that don't need to be chunked, ie.
+  # seasons and episodes. Falls back to getDataProxy() when batching is disabled.
+  def getDataProxyBatch(self, mediatype, requests, trim_cast_thumbs=True, idname=None, uniquecast=None):
+    if not idname:
+      idname = "lib%s" % mediatype.capitalize()
+
+    if self.config.RPC_BATCHSIZE <= 1:
+      return [self.getDataProxy(mediatype, request, trim_cast_thumbs, idname, uniquecast) for request in requests]
+
+    if self.config.CHUNKED:
+      results = self.chunkedBatch(mediatype, requests, idname)
+    else:
+      results = self.sendJSONBatch(requests, idname)
+
+    for (request, data) in zip(requests, results):
+      if "result" in data and trim_cast_thumbs and "cast" in request.get("params",{}).get("properties",[]):
+        for section in data["result"]:
+          if section != "limits":
+            for item in data["result"][section]:
+              self.removecastwithoutthumbs(item, uniquecast)
+
+    return results
+
+  # Send batches of requests whose responses together hold about as many items as a single
+  # chunk. The number of requests in each batch is estimated from the average number of
+  # items returned by the requests so far, and each request is limited to one chunk - any
+  # request with more items than this is then loaded in chunks.
+  def chunkedBatch(self, mediatype, requests, idname):
+    CHUNK_SIZE = 400
+    ESTIMATE = {"seasons": 10, "episodes": 25}.get(mediatype, CHUNK_SIZE)
+
+    results = []
+    items = 0
+    start = 0
+
+    while start < len(requests):
+      average = (float(items) / start) if start != 0 else ESTIMATE
+      count = max(1, min(self.config.RPC_BATCHSIZE, int(CHUNK_SIZE / max(average, 1.0))))
+
+      batch = []
+      for request in requests[start:start + count]:
+        chunk_request = dict(request)
+        chunk_request["params"] = dict(request["params"])
+        chunk_request["params"]["limits"] = {"start": 0, "end": CHUNK_SIZE}
+        batch.append(chunk_request)
+
+      for (request, data) in zip(requests[start:start + count], self.sendJSONBatch(batch, idname)):
+        if "result" in data and "limits" in data["result"]:
+          total = data["result"]["limits"]["total"]
+          items += total
+          if total > CHUNK_SIZE:
+            data = self.chunkedLoad(mediatype, request, trim_cast_thumbs=False, idname=idname, silent=True)
+        results.append(data)
+
+      start += count
+
+    return results
+
   # Load library data in chunks, using limits.
   # Return resulting list of all requested items.
   def chunkedLoad(self, mediatype, request, trim_cast_thumbs=True, idname=None, silent=False, uniquecast=None):
+    section = None
+    results = []
+
+    for (section, items) in self.chunkedLoadChunks(mediatype, request, trim_cast_thumbs, idname, silent, uniquecast):
+      results.extend(items)
+
+    response = {"result": {"limits": {"start": 0, "end": len(results), "total": len(results)}}}
+    if section: response["result"][section] = results
+    return response
+
+  # Load library data in chunks, yielding each item as soon as its chunk is loaded.
+  def chunkedLoadItems(self, mediatype, request, trim_cast_thumbs=True, idname=None, silent=False, uniquecast=None):
+    for (section, items) in self.chunkedLoadChunks(mediatype, request, trim_cast_thumbs, idname, silent, uniquecast):
+      for item in items:
+        yield item
+
+  # Load library data in chunks, using limits.
+  # Yield a tuple of section name and list of items for each chunk.
+  def chunkedLoadChunks(self, mediatype, request, trim_cast_thumbs=True, idname=None, silent=False, uniquecast=None):
     if not idname:
       idname = "libChunked%s" % mediatype.capitalize()
 
@@ -3279,55 +5251,107 @@ class MyJSONComms(object):
       if "cast" in request.get("params",{}).get("properties",[]):
         CHUNK_SIZE = 35
 
+    # Requests can only be kept in flight using the shared RPC connection, so
+    # chunked.inflight requires rpc.shared
+    if self.config.RPC_SHARED and not self.config.LOG_REPLAY_FILENAME:
+      INFLIGHT = self.config.CHUNKED_INFLIGHT
+    else:
+      INFLIGHT = 1
+    connection = None
+    pending = []
+
     chunk = 0
     chunk_start = 0
     total_items = 1
-    chunks = 0
     section = None
-    results = []
+    LAST_RECEIVED = 0
 
-    while chunk_start < total_items:
-      chunk += 1
-      if not silent:
-        # Don't yet know how many chunks there will be
-        if chunk_start != 0:
-          self.logger.progress("Loading %s: Chunk %d of %d..." % (mediatype.capitalize(), chunk, chunks))
+    try:
+      while chunk_start < total_items or pending:
+        chunk += 1
+        if not silent:
+          # Don't yet know how many chunks there will be
+          if chunk_start != 0:
+            chunks = chunk - 1 + len(pending) + -(-max(total_items - chunk_start, 0) // CHUNK_SIZE)
+            self.logger.progress("Loading %s: Chunk %d of %d..." % (mediatype.capitalize(), chunk, chunks))
+          else:
+            self.logger.progress("Loading %s: Chunk %d..." % (mediatype.capitalize(), chunk))
+
+        # Once the total is known, keep sending requests until INFLIGHT are outstanding
+        if section and INFLIGHT > 1:
+          if connection is None:
+            connection = MyRPCConnection.getConnection(self.config, self.logger, self.connecttimeout)
+          while len(pending) < INFLIGHT and chunk_start < total_items:
+            chunk_request = dict(request)
+            chunk_request["params"] = dict(request["params"])
+            chunk_request["params"]["limits"] = {"start": chunk_start, "end": chunk_start + CHUNK_SIZE}
+            chunk_request["jsonrpc"] = "2.0"
+            chunk_request["id"] = idname
+            self.logger.log("%s.JSON SOCKET REQUEST:" % idname, jsonrequest=chunk_request)
+            pending.append((connection.send(chunk_request), time.time()))
+            chunk_start += CHUNK_SIZE
+          (responses, sent) = pending.pop(0)
+          data = self.receiveJSONShared(connection, responses, idname)
         else:
-          self.logger.progress("Loading %s: Chunk %d..." % (mediatype.capitalize(), chunk))
+          request["params"]["limits"] = {"start": chunk_start, "end": chunk_start + CHUNK_SIZE}
+          sent = time.time()
+          data = self.sendJSON(request, idname)
+          chunk_start += CHUNK_SIZE
 
-      request["params"]["limits"] = {"start": chunk_start, "end": chunk_start + CHUNK_SIZE}
-      data = self.sendJSON(request, idname)
-      if "result" not in data: break
+        if "result" not in data: break
 
-      #Get total_items and section name once first chunk is retrieved
-      if chunk_start == 0:
-        if "limits" not in data["result"]:
-          break
+        # Time taken for this response, excluding any time spent waiting for earlier responses
+        received = time.time()
+        elapsed = received - max(sent, LAST_RECEIVED)
+        LAST_RECEIVED = received
+
+        #Get total_items and section name once first chunk is retrieved
+        if section is None:
+          if "limits" not in data["result"]:
+            break
 
-        total_items = data["result"]["limits"]["total"]
-        chunks = -(-total_items // CHUNK_SIZE)
-        self.logger.log("Chunk processing: found %d %s, retrieving in chunks of %d" % (total_items, mediatype, CHUNK_SIZE))
+          total_items = data["result"]["limits"]["total"]
+          self.logger.log("Chunk processing: found %d %s, retrieving in chunks of %d" % (total_items, mediatype, CHUNK_SIZE))
 
-        for s in data.get("result", {}):
-          if s != "limits":
-            section = s
+          for s in data.get("result", {}):
+            if s != "limits":
+              section = s
+              break
+          else:
             break
-        else:
-          break
 
-      # Add section to accumulated results
-      if section and section in data["result"]:
-        # Remove those cast members without thumbnails
-        if trim_cast_thumbs and "cast" in request.get("params",{}).get("properties",[]):
-          for item in data["result"][section]:
-            self.removecastwithoutthumbs(item, uniquecast)
-        results.extend(data["result"][section])
+        # Add section to accumulated results
+        if section in data["result"]:
+          items = data["result"][section]
 
-      chunk_start = (chunk * CHUNK_SIZE)
+          if self.config.CHUNKED_ADAPTIVE:
+            CHUNK_SIZE = self.adaptChunkSize(CHUNK_SIZE, len(items), self.LAST_RESPONSE_SIZE, elapsed)
 
-    response = {"result": {"limits": {"start": 0, "end": len(results), "total": len(results)}}}
-    if section: response["result"][section] = results
-    return response
+          # Remove those cast members without thumbnails
+          if trim_cast_thumbs and "cast" in request.get("params",{}).get("properties",[]):
+            for item in items:
+              self.removecastwithoutthumbs(item, uniquecast)
+          yield (section, items)
+          del items
+    finally:
+      for (responses, sent) in pending:
+        connection.cancel(responses)
+
+  # Size the next chunk so that responses approach chunked.target KB without taking longer
+  # than CHUNK_TIME seconds to load, changing by no more than a factor of two each time.
+  def adaptChunkSize(self, chunk_size, items, nbytes, elapsed):
+    if items == 0 or nbytes == 0: return chunk_size
+
+    ratio = (self.config.CHUNKED_TARGET * 1024.0) / nbytes
+    if elapsed > 0:
+      ratio = min(ratio, self.CHUNK_TIME / elapsed)
+
+    new_size = int(items * min(max(ratio, 0.5), 2.0))
+    new_size = min(max(new_size, 10), 10000)
+
+    if new_size != chunk_size:
+      self.logger.log("Chunk processing: adjusting chunk size from %d to %d (%d items, %d bytes, %f seconds)" % (chunk_size, new_size, items, nbytes, elapsed))
+    return new_size
 
   # Create a new cast list ignoring any cast member without a thumbnail.
   # Replace original cast list with the new cast list.
@@ -3561,6 +5585,10 @@ class MyTotals(object):
     self.PCOUNT = self.PMIN = self.PAVG = self.PMAX = 0
     self.MCOUNT = self.MMIN = self.MAVG = self.MMAX = 0
 
+    # Image requests and bytes transferred, and the budgeted rates (0 if unlimited)
+    self.REQUESTS = self.BYTES = 0
+    self.BUDGET_RATE = self.BUDGET_BANDWIDTH = 0
+
     self.TOTALS = {}
     self.TOTALS["Skipped"] = {}
     self.TOTALS["Deleted"] = {}
@@ -3585,6 +5613,17 @@ class MyTotals(object):
   def TimeEnd(self, mediatype, item):
     self.TIMES[mediatype][item] = (self.TIMES[mediatype][item][0], time.time())
 
+  # Extend (or reduce) an item's duration, for work that is timed in several parts. The
+  # start is adjusted, so that the adjustment is kept by a later TimeEnd().
+  def TimeAdd(self, mediatype, item, seconds):
+    if not mediatype in self.TIMES: self.TIMES[mediatype] = {}
+    (tStart, tEnd) = self.TIMES[mediatype].get(item, (0, 0))
+    self.TIMES[mediatype][item] = (tStart - seconds, tEnd)
+
+  # True if an item has been started, but not yet ended
+  def TimeRunning(self, mediatype, item):
+    return self.TIMES.get(mediatype, {}).get(item, (0, 1))[1] == 0
+
   def TimeDuration(self, item):
     tElapsed = 0
     for m in self.TIMES:
@@ -3638,6 +5677,15 @@ class MyTotals(object):
       if not imgtype in self.TOTALS[action]: self.TOTALS[action][imgtype] = 0
       self.TOTALS[action][imgtype] += 1
 
+  def addTransfer(self, nbytes):
+    with lock:
+      self.REQUESTS += 1
+      self.BYTES += nbytes
+
+  def setBudget(self, rate, bandwidth):
+    self.BUDGET_RATE = rate
+    self.BUDGET_BANDWIDTH = bandwidth
+
   # Calculate and store min/max/avg.
   def setPerformance(self, elapsed):
     with lock:
@@ -3657,6 +5705,58 @@ class MyTotals(object):
       eta = self.secondsToTime(remaining / tpersec, withMillis=False)
       return " (%05.2f downloads per second, ETA: %s)" % (tpersec, eta)
 
+  # Return totals, times and performance in a form that can be saved and merged
+  def getSummary(self):
+    with lock:
+      return {"totals": self.TOTALS, "times": self.TIMES, "etimes": self.ETIMES, "threads": self.THREADS_HIST,
+              "performance": [self.PCOUNT, self.PMIN, self.PAVG, self.PMAX, self.MCOUNT, self.MMIN, self.MAVG, self.MMAX],
+              "transfer": [self.REQUESTS, self.BYTES, self.BUDGET_RATE, self.BUDGET_BANDWIDTH]}
+
+  # Accumulate a summary from another process. Thread names are made unique with the
+  # suffix, and times are merged to cover the period during which any process was active.
+  def mergeSummary(self, summary, suffix):
+    with lock:
+      for action in summary["totals"]:
+        if not action in self.TOTALS: self.TOTALS[action] = {}
+        for imgtype in summary["totals"][action]:
+          self.TOTALS[action][imgtype] = self.TOTALS[action].get(imgtype, 0) + summary["totals"][action][imgtype]
+
+      for mediatype in summary["times"]:
+        if not mediatype in self.TIMES: self.TIMES[mediatype] = {}
+        for item in summary["times"][mediatype]:
+          (start, end) = summary["times"][mediatype][item]
+          if item in self.TIMES[mediatype]:
+            start = min(start, self.TIMES[mediatype][item][0])
+            end = max(end, self.TIMES[mediatype][item][1])
+          self.TIMES[mediatype][item] = (start, end)
+
+      for mediatype in summary["etimes"]:
+        if not mediatype in self.ETIMES: self.ETIMES[mediatype] = {}
+        for imgtype in summary["etimes"][mediatype]:
+          if not imgtype in self.ETIMES[mediatype]: self.ETIMES[mediatype][imgtype] = {}
+          for tname in summary["etimes"][mediatype][imgtype]:
+            self.ETIMES[mediatype][imgtype]["%s%s" % (tname, suffix)] = tuple(summary["etimes"][mediatype][imgtype][tname])
+
+      for tname in summary["threads"]:
+        self.THREADS_HIST["%s%s" % (tname, suffix)] = tuple(summary["threads"][tname])
+
+      (pcount, pmin, pavg, pmax, mcount, mmin, mavg, mmax) = summary["performance"]
+      self.PCOUNT += pcount
+      self.PAVG += pavg
+      if pmin != 0 and (self.PMIN == 0 or pmin < self.PMIN): self.PMIN = pmin
+      if pmax > self.PMAX: self.PMAX = pmax
+      self.MCOUNT += mcount
+      self.MAVG += mavg
+      if mmin != 0 and (self.MMIN == 0 or mmin < self.MMIN): self.MMIN = mmin
+      if mmax > self.MMAX: self.MMAX = mmax
+
+      # Each shard has its own budget, so the budgets of all shards add up
+      (requests, nbytes, rate, bandwidth) = summary.get("transfer", [0, 0, 0, 0])
+      self.REQUESTS += requests
+      self.BYTES += nbytes
+      self.BUDGET_RATE += rate
+      self.BUDGET_BANDWIDTH += bandwidth
+
   def libraryStats(self, item="", multi=[], filter="", lastRun=False, query=""):
     if multi: item = "/".join(multi)
 
@@ -3796,8 +5896,23 @@ class MyTotals(object):
     if len(self.THREADS_HIST) != 0:
       print("   Downloading: %s" % self.secondsToTime(self.TimeDuration("Download")))
 
+    # Achieved throughput, compared with any budget
+    if self.BUDGET_RATE or self.BUDGET_BANDWIDTH:
+      elapsed = self.TimeDuration("Download")
+      elapsed = elapsed if elapsed != 0 else 1.0
+      print("  Request Rate: %0.2f per second (budget %s)" %
+            (self.REQUESTS / elapsed, "%0.2f per second" % self.BUDGET_RATE if self.BUDGET_RATE else "unlimited"))
+      print("     Bandwidth: %s per second (budget %s)" %
+            (self.bytesToSize(self.BYTES / elapsed), "%s per second" % self.bytesToSize(self.BUDGET_BANDWIDTH) if self.BUDGET_BANDWIDTH else "unlimited"))
+
     print(" TOTAL RUNTIME: %s" % self.secondsToTime(self.TimeDuration("Total")))
 
+  def bytesToSize(self, nbytes):
+    for unit in ["bytes", "KB", "MB"]:
+      if nbytes < 1024.0: return "%0.2f %s" % (nbytes, unit)
+      nbytes /= 1024.0
+    return "%0.2f GB" % nbytes
+
   def secondsToTime(self, seconds, withMillis=True):
     ms = int(100 * (seconds - int(seconds)))
     m, s = divmod(seconds, 60)
@@ -3842,6 +5957,17 @@ class MyMediaItem(object):
     self.cachedurl = cachedurl
     self.libraryid = libraryid
     self.missingOK = missingOK
+    self.domain = None
+    self.jobid = None
+    self.attempts = 0
+    self.rowexists = True
+    self.failure = None
+    self.unavailable = False
+    self.priority = 0
+    self.usecount = 0
+    self.lastused = ""
+    self.imagehash = ""
+    self.prepared = None
 
   def __str__(self):
     season = "\"%s\"" % self.season if self.season else self.season
@@ -3955,6 +6081,8 @@ class MyUtility(object):
 
   RE_NOT_DIGITS = re.compile("[^0123456789]")
 
+  KODI_ENCODE_MAP = None
+
   # Convert quoted filename into consistent UTF-8
   # representation for both Python2 and Python3
   @staticmethod
@@ -3970,15 +6098,21 @@ class MyUtility(object):
         v = v[s:e]
 
     if not MyUtility.isPython3:
-      try:
-        v = bytes(v.encode("iso-8859-1")).decode("utf-8")
-      except UnicodeDecodeError:
-        pass
-      except UnicodeEncodeError:
-        pass
+      v = MyUtility.redecode(v)
 
     return v
 
+  # Decode text that was decoded as iso-8859-1 but is really utf-8, leaving it
+  # unchanged if not
+  @staticmethod
+  def redecode(value):
+    try:
+      return bytes(value.encode("iso-8859-1")).decode("utf-8")
+    except UnicodeDecodeError:
+      return value
+    except UnicodeEncodeError:
+      return value
+
   # Quote unquoted filename
   @staticmethod
   def denormalise(value, prefix=True):
@@ -3995,6 +6129,20 @@ class MyUtility(object):
 
     return MyUtility.toUnicode(v)
 
+  # Encode value the same way as Kodi CURL::Encode() - alphanumerics and "-_.!()"
+  # are unchanged, all other bytes of the UTF-8 representation become lowercase %xx
+  @staticmethod
+  def kodiEncode(value):
+    if MyUtility.KODI_ENCODE_MAP is None:
+      safe = "abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789-_.!()"
+      MyUtility.KODI_ENCODE_MAP = [chr(c) if chr(c) in safe else "%%%02x" % c for c in range(256)]
+
+    if not isinstance(value, bytes):
+      value = value.encode("utf-8")
+
+    emap = MyUtility.KODI_ENCODE_MAP
+    return "".join([emap[c] for c in bytearray(value)])
+
   @staticmethod
   def toUnicode(data):
     if MyUtility.isPython3: return data
@@ -4520,7 +6668,7 @@ def jsonQuery(action, mediatype, filter="", force=False, extraFields=False, resc
   TOTALS.TimeStart(mediatype, "Total")
 
   jcomms = MyJSONComms(gConfig, gLogger)
-  database = MyDB(gConfig, gLogger)
+  database = MyDB(gConfig, gLogger, readonly=(nodownload or not gConfig.DOWNLOAD_PREDELETE))
 
   if mediatype == "tvshows":
     TOTALS.addSeasonAll()
@@ -4540,6 +6688,14 @@ def jsonQuery(action, mediatype, filter="", force=False, extraFields=False, resc
   # duplicates that can be discarded.
   UCAST = {}
 
+  # Pipeline artwork caching with the loading of library items. Not possible when
+  # items are modified after loading, or all items must be deleted before downloading.
+  pipeline = (action == "cache" and gConfig.CACHE_PIPELINE and not nodownload and not lastRun and
+              not (force and gConfig.DOWNLOAD_PREDELETE))
+
+  # Set when items are loaded as they're processed, rather than before processing
+  stream = False
+
   if mediatype in ["pvr.tv", "pvr.radio"] and not gConfig.HAS_PVR:
     (section_name, title_name, id_name, data) = ("", "", "", [])
   elif mediatype == "vgenres":
@@ -4562,8 +6718,13 @@ def jsonQuery(action, mediatype, filter="", force=False, extraFields=False, resc
     section_name = mediatype
     data["result"] = {section_name: _data}
   else:
+    # Process items as each chunk is loaded, when the items aren't modified after loading
+    stream = ((gConfig.CHUNKED_STREAM or pipeline) and not lastRun and action in ["cache", "qa", "dump", "query"] and
+              mediatype in ["movies", "tags", "musicvideos", "songs", "artists", "albums"] and
+              not (action == "dump" and mediatype == "albums" and gConfig.ADD_SONG_MEMBERS))
     (section_name, title_name, id_name, data) = jcomms.getData(action, mediatype, filter, extraFields,
-                                                               lastRun=lastRun, secondaryFields=secondaryFields, uniquecast=UCAST)
+                                                               lastRun=lastRun, secondaryFields=secondaryFields, uniquecast=UCAST,
+                                                               stream=stream)
 
   if data and "result" in data and section_name in data["result"]:
     data = data["result"][section_name]
@@ -4628,31 +6789,15 @@ def jsonQuery(action, mediatype, filter="", force=False, extraFields=False, resc
                         "channels": channels})
     data = pvrdata
 
+  # Load seasons and episodes for groups of TV shows, using batched requests. When
+  # pipelined, each group of TV shows is processed as soon as it has been loaded.
   if mediatype == "tvshows" and gConfig.QUERY_SEASONS:
-    for tvshow in data:
-      title = tvshow["title"]
-      gLogger.progress("Loading TV show: %s..." % title)
-
-      (s2, t2, i2, data2) = jcomms.getData(action, "seasons", filter, extraFields, tvshow=tvshow, lastRun=lastRun, uniquecast=UCAST)
-      if not "result" in data2: return
-      limits = data2["result"]["limits"]
-      if limits["total"] == 0: continue
-      tvshow[s2] = data2["result"][s2]
-      for season in tvshow[s2]:
-        seasonid = season["season"]
-        if seasonid < 0:
-          gLogger.err("WARNING: TV show [%s] has invalid season (%d) - ignored" % (title, seasonid), newLine=True)
-          continue
-
-        gLogger.progress("Loading TV show: %s, season %d..." % (title, seasonid))
-
-        if gConfig.QUERY_EPISODES:
-          (s3, t3, i3, data3) = jcomms.getData(action, "episodes", filter, extraFields, tvshow=tvshow, tvseason=season,
-                                               lastRun=lastRun, secondaryFields=secondaryFields, uniquecast=UCAST)
-          if not "result" in data3: return
-          limits = data3["result"]["limits"]
-          if limits["total"] == 0: continue
-          season[s3] = data3["result"][s3]
+    if pipeline:
+      data = iterTVShowDetails(jcomms, action, filter, extraFields, lastRun, secondaryFields, data, UCAST)
+      stream = True
+    else:
+      for tvshows in loadTVShowDetails(jcomms, action, filter, extraFields, lastRun, secondaryFields, data, UCAST):
+        pass
 
   del UCAST
 
@@ -4681,11 +6826,15 @@ def jsonQuery(action, mediatype, filter="", force=False, extraFields=False, resc
 
     if len(data) != 0: gLogger.out("", newLine=True)
 
+  # Streamed items are timed as they're loaded
+  if stream:
+    data = iterLoadTimed(mediatype, data)
+
   TOTALS.TimeEnd(mediatype, "Load")
 
-  if data != []:
+  if stream or data != []:
     if action == "cache":
-      cacheImages(mediatype, jcomms, database, data, title_name, id_name, force, nodownload, drop_items)
+      cacheImages(mediatype, jcomms, database, data, title_name, id_name, force, nodownload, drop_items, pipeline)
     elif action == "qa":
       qaData(mediatype, jcomms, database, data, title_name, id_name, rescan)
     elif action == "dump":
@@ -4713,6 +6862,78 @@ def jsonQuery(action, mediatype, filter="", force=False, extraFields=False, resc
 
   TOTALS.TimeEnd(mediatype, "Total")
 
+# Load seasons and episodes for groups of TV shows using batched requests, yielding
+# each group of TV shows once loaded. TV shows or seasons that fail to load are ignored.
+def loadTVShowDetails(jcomms, action, filter, extraFields, lastRun, secondaryFields, data, UCAST):
+  BATCH_SIZE = max(gConfig.RPC_BATCHSIZE, 1)
+  for start in range(0, len(data), BATCH_SIZE):
+    tvshows = data[start:start + BATCH_SIZE]
+    gLogger.progress("Loading TV shows: %d of %d..." % (start + len(tvshows), len(data)))
+
+    requests = []
+    for tvshow in tvshows:
+      (s2, t2, i2, request) = jcomms.getDataRequest(action, "seasons", filter, extraFields, tvshow=tvshow, lastRun=lastRun)
+      requests.append(request)
+
+    seasons = []
+    for (tvshow, data2) in zip(tvshows, jcomms.getDataProxyBatch("seasons", requests, trim_cast_thumbs=(action != "dump"), uniquecast=UCAST)):
+      if not "result" in data2:
+        gLogger.err("WARNING: Failed to load seasons for TV show [%s] - ignored" % tvshow["title"], newLine=True)
+        gLogger.log("Failed to load seasons for TV show [%s], response: %s" % (tvshow["title"], data2))
+        continue
+      limits = data2["result"]["limits"]
+      if limits["total"] == 0: continue
+      tvshow[s2] = data2["result"][s2]
+      for season in tvshow[s2]:
+        seasonid = season["season"]
+        if seasonid < 0:
+          gLogger.err("WARNING: TV show [%s] has invalid season (%d) - ignored" % (tvshow["title"], seasonid), newLine=True)
+          continue
+        seasons.append((tvshow, season))
+
+    if gConfig.QUERY_EPISODES and seasons:
+      requests = []
+      for (tvshow, season) in seasons:
+        (s3, t3, i3, request) = jcomms.getDataRequest(action, "episodes", filter, extraFields, tvshow=tvshow, tvseason=season,
+                                                      lastRun=lastRun, secondaryFields=secondaryFields)
+        requests.append(request)
+
+      for ((tvshow, season), data3) in zip(seasons, jcomms.getDataProxyBatch("episodes", requests, trim_cast_thumbs=(action != "dump"), uniquecast=UCAST)):
+        if not "result" in data3:
+          gLogger.err("WARNING: Failed to load episodes for TV show [%s], season %d - ignored" % (tvshow["title"], season["season"]), newLine=True)
+          gLogger.log("Failed to load episodes for TV show [%s], season %d, response: %s" % (tvshow["title"], season["season"], data3))
+          continue
+        limits = data3["result"]["limits"]
+        if limits["total"] == 0: continue
+        season[s3] = data3["result"][s3]
+
+    yield tvshows
+
+# Yield individual TV shows with seasons and episodes as each group is loaded
+def iterTVShowDetails(jcomms, action, filter, extraFields, lastRun, secondaryFields, data, UCAST):
+  for tvshows in loadTVShowDetails(jcomms, action, filter, extraFields, lastRun, secondaryFields, data, UCAST):
+    for tvshow in tvshows:
+      yield tvshow
+
+# Yield streamed items, adding the time taken to load each item to the Load time. When
+# items are loaded while being parsed, the time is moved from Parse to Load.
+def iterLoadTimed(mediatype, items):
+  items = iter(items)
+  while True:
+    tStart = time.time()
+    try:
+      item = next(items)
+    except StopIteration:
+      item = None
+    elapsed = time.time() - tStart
+
+    TOTALS.TimeAdd(mediatype, "Load", elapsed)
+    if TOTALS.TimeRunning(mediatype, "Parse"):
+      TOTALS.TimeAdd(mediatype, "Parse", -elapsed)
+
+    if item is None: break
+    yield item
+
 #
 # Parse the supplied JSON data, turning it into a list of artwork urls
 # (mediaitems) that should be matched against the database (cached files)
@@ -4723,7 +6944,9 @@ def jsonQuery(action, mediatype, filter="", force=False, extraFields=False, resc
 # 1..n threads. Errors will be added to an error queue by the threads, and
 # subsueqently displayed to the user at the end.
 #
-def cacheImages(mediatype, jcomms, database, data, title_name, id_name, force, nodownload, drop_items):
+def cacheImages(mediatype, jcomms, database, data, title_name, id_name, force, nodownload, drop_items, pipeline=False):
+  if pipeline:
+    return cacheImages_pipeline(mediatype, jcomms, database, data, title_name, id_name, force, drop_items)
 
   mediaitems = []
   imagecache = {}
@@ -4738,6 +6961,10 @@ def cacheImages(mediatype, jcomms, database, data, title_name, id_name, force, n
   # Don't need this data anymore, make it available for garbage collection
   del data, imagecache
 
+  cacheMediaItems(mediatype, jcomms, database, mediaitems, force, nodownload, drop_items)
+
+# Match media items with cached artwork, then download any items that are missing or stale
+def cacheMediaItems(mediatype, jcomms, database, mediaitems, force, nodownload, drop_items):
   # Match media library items with any cached artwork
   matchTextures(mediatype, mediaitems, jcomms, database, force, nodownload)
 
@@ -4754,13 +6981,9 @@ def cacheImages(mediatype, jcomms, database, data, title_name, id_name, force, n
   itemCount = 0
   for item in mediaitems:
     if item.status in [MyMediaItem.STATUS_MISSING, MyMediaItem.STATUS_STALE]:
+      if not nodownload and isKnownFailure(item, force, drop_items): continue
       itemCount += 1
-      if ITEMLIMIT == -1 or itemCount < ITEMLIMIT:
-        reason = "Need to cache" if item.status == MyMediaItem.STATUS_MISSING else "Cache stale  "
-        MSG = "%s: [%-10s] for %s: %s\n" % (reason, item.itype.center(10), re.sub("(.*)s$", "\\1", item.mtype), item.getFullName())
-        gLogger.out(MSG)
-      elif itemCount == ITEMLIMIT:
-        gLogger.out("...and many more! (First %d items shown)\n" % ITEMLIMIT)
+      showCacheItem(item, itemCount, ITEMLIMIT)
 
   if nodownload:
     TOTALS.addNotCached()
@@ -4771,11 +6994,10 @@ def cacheImages(mediatype, jcomms, database, data, title_name, id_name, force, n
   # Don't proceed beyond this point unless there is something to download...
   if itemCount == 0 or nodownload: return
 
+  if gJournal: gJournal.media(mediatype)
+
   # Queue up the items to be downloaded...
-  single_work_queue = Queue.Queue()
-  multiple_work_queue = Queue.Queue()
-  error_queue = Queue.Queue()
-  complete_queue = Queue.Queue()
+  work_queue = MyWorkScheduler(gConfig, gLogger)
 
   gLogger.out("\n")
 
@@ -4797,16 +7019,17 @@ def cacheImages(mediatype, jcomms, database, data, title_name, id_name, force, n
     dbitem = 0
     with database:
       for ui in sorted(unique_items):
-        for item in mediaitems:
-          if item.dbid != 0 and item.itype == ui:
-            dbitem += 1
-            gLogger.progress("Pre-deleting cached items %d of %d... rowid %d, cachedurl %s" % (dbitem, dbitems, item.dbid, item.cachedurl))
-            TOTALS.start(item.mtype, item.itype)
-            database.deleteItem(item.dbid, item.cachedurl)
-            TOTALS.bump("Deleted", item.itype)
-            TOTALS.finish(item.mtype, item.itype)
-            item.dbid = 0
-            item.cachedurl = ""
+        items = [item for item in mediaitems if item.dbid != 0 and item.itype == ui]
+        if items == []: continue
+        dbitem += len(items)
+        gLogger.progress("Pre-deleting cached items %d of %d... %s" % (dbitem, dbitems, ui))
+        TOTALS.start(mediatype, ui)
+        database.deleteItems([(item.dbid, item.cachedurl) for item in items])
+        TOTALS.finish(mediatype, ui)
+        for item in items:
+          TOTALS.bump("Deleted", item.itype)
+          item.dbid = 0
+          item.cachedurl = ""
     TOTALS.stop()
     TOTALS.TimeEnd(mediatype, "PreDelete")
     gLogger.progress("")
@@ -4817,58 +7040,120 @@ def cacheImages(mediatype, jcomms, database, data, title_name, id_name, force, n
       if item.status in [MyMediaItem.STATUS_MISSING, MyMediaItem.STATUS_STALE] and item.itype == ui:
         c += 1
 
-        isSingle = False
-        if gConfig.SINGLETHREAD_URLS:
-          for site in gConfig.SINGLETHREAD_URLS:
-            if site.search(item.decoded_filename):
-              sc += 1
-              if gLogger.VERBOSE and gLogger.LOGGING: gLogger.log("QUEUE ITEM: single [%s], %s" % (site.pattern, item))
-              single_work_queue.put(item)
-              item.status = MyMediaItem.STATUS_QUEUED
-              isSingle = True
-              break
-
-        if not isSingle:
+        if queueCacheItem(work_queue, item):
+          sc += 1
+        else:
           mc += 1
-          if gLogger.VERBOSE and gLogger.LOGGING: gLogger.log("QUEUE ITEM: %s" % item)
-          multiple_work_queue.put(item)
-          item.status = MyMediaItem.STATUS_QUEUED
 
         gLogger.progress("Queueing work item: single thread %d, multi thread %d" % (sc, mc), every=50, finalItem=(c==itemCount))
 
   # Don't need this data anymore, make it available for garbage collection
   del mediaitems
 
+  # Serialised domains get one thread between them, in addition to the normal thread
+  # count. All threads take work from any domain that has capacity.
+  tCount = gConfig.DOWNLOAD_THREADS["download.threads.%s" % mediatype]
+  THREADCOUNT = (tCount if tCount <= mc else mc) + (1 if sc != 0 else 0)
+
+  downloadImages(mediatype, work_queue, THREADCOUNT, itemCount, force, drop_items)
+
+# Pipelined cache - items are parsed, matched and queued for download by a producer
+# thread as they are loaded, while the download threads work on the queue.
+def cacheImages_pipeline(mediatype, jcomms, database, data, title_name, id_name, force, drop_items):
+  work_queue = MyWorkScheduler(gConfig, gLogger, closed=False)
+
+  if gJournal: gJournal.media(mediatype)
+
+  producer = MyCacheProducer(mediatype, jcomms, database, data, title_name, id_name, force, work_queue, drop_items)
+  producer.setDaemon(True)
+  producer.start()
+
+  # Number of items isn't known in advance, so allow for serialised domains
+  tCount = gConfig.DOWNLOAD_THREADS["download.threads.%s" % mediatype]
+  THREADCOUNT = tCount + (1 if gConfig.SINGLETHREAD_URLS else 0)
+
+  downloadImages(mediatype, work_queue, THREADCOUNT, 0, force, drop_items, producer=producer)
+
+  producer.join()
+  if producer.error: raise producer.error
+
+def showCacheItem(item, itemCount, ITEMLIMIT):
+  if ITEMLIMIT == -1 or itemCount < ITEMLIMIT:
+    reason = "Need to cache" if item.status == MyMediaItem.STATUS_MISSING else "Cache stale  "
+    MSG = "%s: [%-10s] for %s: %s\n" % (reason, item.itype.center(10), re.sub("(.*)s$", "\\1", item.mtype), item.getFullName())
+    gLogger.out(MSG)
+  elif itemCount == ITEMLIMIT:
+    gLogger.out("...and many more! (First %d items shown)\n" % ITEMLIMIT)
+
+# Add item to the download queue, returning True if queued for a serialised domain
+def queueCacheItem(work_queue, item):
+  if gJournal: gJournal.queued(item)
+  if gConfig.CACHE_PRIORITY: item.priority = getCachePriority(item)
+  isSingle = work_queue.put(item)
+  if gLogger.VERBOSE and gLogger.LOGGING:
+    if isSingle:
+      gLogger.log("QUEUE ITEM: single [%s], %s" % (item.domain, item))
+    else:
+      gLogger.log("QUEUE ITEM: %s" % item)
+  item.status = MyMediaItem.STATUS_QUEUED
+  return isSingle
+
+# Priority of an item in the download queue, lowest first. Artwork the GUI is likely to show
+# comes first, then artwork that has been used most recently and often (only known when
+# re-caching), with the most recently added library items (highest libraryid) breaking ties.
+def getCachePriority(item):
+  if item.itype in gConfig.CACHE_PRIORITY_ARTWORK:
+    rank = gConfig.CACHE_PRIORITY_ARTWORK.index(item.itype)
+  else:
+    rank = len(gConfig.CACHE_PRIORITY_ARTWORK)
+  lastused = int(re.sub("[^0-9]", "", item.lastused or "") or 0)
+  libraryid = item.libraryid if isinstance(item.libraryid, int) else 0
+  return (rank, -lastused, -item.usecount, -libraryid)
+
+# Download queued items using THREADCOUNT threads, then report any errors. When a pipeline
+# producer is supplied, items continue to be queued while downloading is in progress.
+def downloadImages(mediatype, work_queue, THREADCOUNT, itemCount, force, drop_items, producer=None):
+  error_queue = Queue.Queue()
+  complete_queue = Queue.Queue()
+
   TOTALS.TimeStart(mediatype, "Download")
+  TOTALS.setBudget(gConfig.DOWNLOAD_RATE, gConfig.DOWNLOAD_BANDWIDTH)
 
   THREADS = []
 
-  if not single_work_queue.empty():
-    gLogger.log("Creating 1 download thread for single access sites")
-    t = MyImageLoader(single_work_queue, multiple_work_queue, error_queue, complete_queue,
-                      gConfig, gLogger, TOTALS, force, gConfig.DOWNLOAD_RETRY)
+  # Optional prepare stage, resolving download URLs ahead of the download threads
+  PREPARERS = []
+  prepared_queue = None
+  if gConfig.DOWNLOAD_PREPARE_THREADS > 0:
+    prepared_queue = MyPreparedQueue(max(1, gConfig.DOWNLOAD_PREPARE_QUEUE))
+    work_queue.setPrepared(True)
+    gLogger.log("Creating %d prepare thread(s)" % gConfig.DOWNLOAD_PREPARE_THREADS)
+    for i in range(gConfig.DOWNLOAD_PREPARE_THREADS):
+      t = MyImagePreparer(work_queue, prepared_queue, gConfig, gLogger, TOTALS, force, gConfig.DOWNLOAD_RETRY)
+      PREPARERS.append(t)
+      t.setDaemon(True)
+
+  gLogger.log("Creating %d download thread(s) for %d domain(s)" % (THREADCOUNT, len(work_queue.domains)))
+  for i in range(THREADCOUNT):
+    t = MyImageLoader(work_queue, error_queue, complete_queue,
+                      gConfig, gLogger, TOTALS, force, gConfig.DOWNLOAD_RETRY, prepared_queue)
     THREADS.append(t)
     t.setDaemon(True)
 
-  if not multiple_work_queue.empty():
-    tCount = gConfig.DOWNLOAD_THREADS["download.threads.%s" % mediatype]
-    THREADCOUNT = tCount if tCount <= mc else mc
-    gLogger.log("Creating %d download thread(s) for multi-access sites" % THREADCOUNT)
-    for i in range(THREADCOUNT):
-      t = MyImageLoader(multiple_work_queue, single_work_queue, error_queue, complete_queue,
-                        gConfig, gLogger, TOTALS, force, gConfig.DOWNLOAD_RETRY)
-      THREADS.append(t)
-      t.setDaemon(True)
-
   # Start the threads...
-  for t in THREADS: t.start()
+  for t in PREPARERS + THREADS: t.start()
 
   threadcount = len(THREADS)
 
+  tuner = MyDownloadTuner(gConfig, gLogger, TOTALS, threadcount) if gConfig.DOWNLOAD_THREADS_AUTO else None
+  monitor = MyActivityMonitor(gConfig, gLogger) if gConfig.DOWNLOAD_ACTIVITY_THREADS >= 0 else None
+  throttled = False
+
   updateInterval = 1.0
+  itemsCompleted = 0
   itemsRemaining = itemCount
   perfhistory = []
-  showProgress(threadcount, itemCount, single_work_queue.qsize(), multiple_work_queue.qsize(), error_queue.qsize(), itemsRemaining)
+  showProgress(threadcount, itemCount, work_queue.qsize(serial=True), work_queue.qsize(serial=False), error_queue.qsize(), itemsRemaining)
   while threadcount > 0:
     pace = time.time()
     completed = 0
@@ -4880,14 +7165,43 @@ def cacheImages(mediatype, jcomms, database, data, title_name, id_name, force, n
           threadcount -= 1
         else:
           completed += 1
-          itemsRemaining -= 1
+          itemsCompleted += 1
+          if gJournal: gJournal.completed(qItem)
+          if gFailureCache: gFailureCache.update(qItem)
         if (time.time() - pace) >= updateInterval or threadcount <= 0:
           break
       except Queue.Empty:
         break
-    showProgress(threadcount, itemCount, single_work_queue.qsize(), multiple_work_queue.qsize(), error_queue.qsize(),
+    if producer: itemCount = producer.itemCount
+    itemsRemaining = itemCount - itemsCompleted
+    showProgress(threadcount, itemCount, work_queue.qsize(serial=True), work_queue.qsize(serial=False), error_queue.qsize(),
                   itemsRemaining, completed, time.time() - pace, perfhistory)
 
+    if monitor and threadcount > 0:
+      throttled = monitor.check(work_queue)
+      # Throughput while throttled is no guide to the best number of threads
+      if throttled and tuner: tuner.reset()
+
+    # Once the prepare stage has finished, the download threads can finish too
+    if PREPARERS and not [t for t in PREPARERS if t.is_alive()]:
+      prepared_queue.finish()
+      PREPARERS = []
+
+    if tuner and not throttled and threadcount > 0 and not work_queue.empty():
+      delta = tuner.sample(completed, time.time() - pace)
+      if delta > 0:
+        for i in range(delta):
+          t = MyImageLoader(work_queue, error_queue, complete_queue,
+                            gConfig, gLogger, TOTALS, force, gConfig.DOWNLOAD_RETRY, prepared_queue)
+          t.setDaemon(True)
+          t.start()
+          threadcount += 1
+      elif delta < 0:
+        if prepared_queue:
+          prepared_queue.retire(-delta)
+        else:
+          work_queue.retire(-delta)
+
   TOTALS.TimeEnd(mediatype, "Download")
 
   gLogger.progress("", newLine=True, noBlank=True)
@@ -4898,21 +7212,108 @@ def cacheImages(mediatype, jcomms, database, data, title_name, id_name, force, n
       item = error_queue.get()
       error_queue.task_done()
 
-      # Ignore itypes with a period, eg. "cast.thumb" or "season.banner"
-      if item.mtype in ["sets", "movies", "tvshows", "seasons", "episodes"] and item.itype.find(".") == -1:
-        drop_id = "%s#%d" % (item.mtype, item.libraryid)
-        if drop_id not in drop_items:
-          drop_items[drop_id] = {"libraryid": item.libraryid, "title": item.name, "type": item.getTypeSingular(), "items": {}}
-        drop_item = drop_items[drop_id]
-        artwork_items = drop_item["items"]
-        artwork_items["art.%s" % item.itype] = ""
-        drop_item["items"] = artwork_items
-        drop_items[drop_id] = drop_item
+      addDropItem(drop_items, item)
 
       name = addEllipsis(50, item.getFullName())
       gLogger.out("[%-10s] [%-40s] %s\n" % (item.itype, name, item.decoded_filename))
       gLogger.log("ERROR ITEM: %s" % item)
 
+def addDropItem(drop_items, item):
+  # Ignore itypes with a period, eg. "cast.thumb" or "season.banner"
+  if item.mtype in ["sets", "movies", "tvshows", "seasons", "episodes"] and item.itype.find(".") == -1:
+    drop_id = "%s#%d" % (item.mtype, item.libraryid)
+    if drop_id not in drop_items:
+      drop_items[drop_id] = {"libraryid": item.libraryid, "title": item.name, "type": item.getTypeSingular(), "items": {}}
+    drop_item = drop_items[drop_id]
+    artwork_items = drop_item["items"]
+    artwork_items["art.%s" % item.itype] = ""
+    drop_item["items"] = artwork_items
+    drop_items[drop_id] = drop_item
+
+# Return True if the item failed to download in a recent run, in which case it won't
+# be downloaded again until the failure expires (unless forced)
+def isKnownFailure(item, force, drop_items):
+  if gFailureCache is None or force: return False
+
+  failure = gFailureCache.get(item)
+  if failure is None: return False
+
+  item.status = MyMediaItem.STATUS_IGNORE
+  TOTALS.bump("Known Failure", item.itype)
+  addDropItem(drop_items, item)
+  gLogger.log("Skipping known failure [%s] from %s: %s" %
+              (failure["reason"], datetime.datetime.fromtimestamp(failure["time"]).strftime("%Y-%m-%d %H:%M:%S"), item.decoded_filename))
+  return True
+
+# Resume an interrupted cache run, downloading only those items in the journal that
+# were queued but never completed. Items are matched against the texture cache again
+# in case they have since been cached (or deleted, when forcing).
+def resumeCache():
+  if not gConfig.CACHE_JOURNAL or not os.path.exists(gConfig.CACHE_JOURNAL):
+    gLogger.err("ERROR: No journal to resume - specify the journal file with cache.journal", newLine=True)
+    sys.exit(2)
+
+  global gJournal, gFailureCache
+
+  (force, jobs) = MyJournal.load(gConfig.CACHE_JOURNAL)
+
+  gJournal = MyJournal(gConfig, gLogger)
+  gJournal.open(force)
+
+  if gConfig.CACHE_FAILURES:
+    gFailureCache = MyFailureCache(gConfig, gLogger)
+    gFailureCache.load()
+
+  jcomms = MyJSONComms(gConfig, gLogger)
+  database = MyDB(gConfig, gLogger, readonly=(not gConfig.DOWNLOAD_PREDELETE))
+  drop_items = {}
+
+  for (mediatype, mediaitems) in jobs:
+    gLogger.log("Resuming %d outstanding %s item(s) from journal %s" % (len(mediaitems), mediatype, gConfig.CACHE_JOURNAL))
+    TOTALS.TimeStart(mediatype, "Total")
+    TOTALS.TimeStart(mediatype, "Load")
+    TOTALS.TimeEnd(mediatype, "Load")
+    cacheMediaItems(mediatype, jcomms, database, mediaitems, force, False, drop_items)
+    TOTALS.TimeEnd(mediatype, "Total")
+
+  gJournal.close()
+  if gFailureCache: gFailureCache.save()
+
+  dump_drop_items(drop_items)
+  TOTALS.libraryStats(multi=[m for (m, i) in jobs])
+
+# Save the totals of a cache run, so that the totals of several shards can be merged
+def writeShardSummary(multi, filter):
+  summary = TOTALS.getSummary()
+  summary["shard"] = gConfig.CACHE_SHARD
+  summary["multi"] = multi
+  summary["filter"] = filter
+
+  outfile = codecs.open(gConfig.CACHE_SHARD_SUMMARY, "wb", encoding="utf-8")
+  outfile.write(json.dumps(summary, indent=2, ensure_ascii=True, sort_keys=True))
+  outfile.close()
+
+# Combine the summaries of sharded cache runs, and output the totals
+def mergeShards(filenames):
+  multi = []
+  filter = ""
+
+  for filename in filenames:
+    try:
+      infile = codecs.open(filename, "r", encoding="utf-8")
+      summary = json.loads(infile.read())
+      infile.close()
+    except (IOError, ValueError) as e:
+      gLogger.err("ERROR: Unable to read shard summary [%s]: %s" % (filename, e), newLine=True)
+      sys.exit(2)
+
+    TOTALS.mergeSummary(summary, "@%s" % (summary.get("shard", "") or filename))
+    for m in summary.get("multi", []):
+      if m not in multi: multi.append(m)
+    filter = summary.get("filter", filter)
+
+  TOTALS.libraryStats(multi=multi, filter=filter)
+
 def dump_drop_items(drop_items):
   if gConfig.CACHE_DROP_INVALID_FILE:
     outfile = codecs.open(gConfig.CACHE_DROP_INVALID_FILE, "wb", encoding="utf-8")
@@ -4965,7 +7366,9 @@ def matchTextures(mediatype, mediaitems, jcomms, database, force, nodownload):
 
   TOTALS.TimeStart(mediatype, "Compare")
 
-  if gConfig.CHUNKED:
+  if gConfig.DBJOIN and not gConfig.USEJSONDB:
+    matchTextures_join(mediatype, mediaitems, jcomms, database, force, nodownload)
+  elif gConfig.CHUNKED:
     matchTextures_chunked(mediatype, mediaitems, jcomms, database, force, nodownload)
   else:
     matchTextures_fast(mediatype, mediaitems, jcomms, database, force, nodownload)
@@ -4979,8 +7382,8 @@ def matchTextures_fast(mediatype, mediaitems, jcomms, database, force, nodownloa
 
   dbfiles = {}
   with database:
-    for r in database.getRows(allfields=False):
-      dbfiles[r["url"]] = r
+    for r in database.iterRows(allfields=(force and (gConfig.CACHE_PRIORITY or gConfig.CACHE_REVALIDATE))):
+      dbfiles[r.url] = r
 
   gLogger.log("Loaded %d items from texture cache database" % len(dbfiles))
 
@@ -5013,32 +7416,26 @@ def matchTextures_chunked(mediatype, mediaitems, jcomms, database, force, nodown
     url_to_index[item.decoded_filename] = inum
 
   dbindex = 0
-  dbmax = 0
 
   with database:
     folders = database.getTextureFolders()
 
-    for fnum, folder in enumerate(folders):
+    for fnum, (folder, dbrows) in enumerate(database.iterTextureFolders(allfields=(force and (gConfig.CACHE_PRIORITY or gConfig.CACHE_REVALIDATE)))):
       # Once all library items have been matched, no need to continue querying textures DB
       if unmatched == 0: break
 
-      gLogger.progress("Loading Textures DB: chunk %2d of %d [unmatched %d: matched %d, skipped %d] (%d of %d)" %
-        (fnum+1, len(folders), unmatched, matched, skipped, dbindex, dbmax))
-
-      dbfiles = []
-      for r in database.getRows(database.getTextureFolderFilter(folder), allfields=False):
-        dbfiles.append(r)
+      gLogger.progress("Loading Textures DB: chunk %2d of %d [unmatched %d: matched %d, skipped %d] (%d)" %
+        (fnum+1, len(folders), unmatched, matched, skipped, dbindex))
 
       dbindex = 0
-      dbmax = len(dbfiles)
 
-      for dbrow in dbfiles:
+      for dbrow in dbrows:
         dbindex += 1
 
-        gLogger.progress("Loading Textures DB: chunk %2d of %d [unmatched %d: matched %d, skipped %d] (%d of %d)" %
-          (fnum+1, len(folders), unmatched, matched, skipped, dbindex, dbmax), every=50, finalItem=(dbindex==dbmax))
+        gLogger.progress("Loading Textures DB: chunk %2d of %d [unmatched %d: matched %d, skipped %d] (%d)" %
+          (fnum+1, len(folders), unmatched, matched, skipped, dbindex), every=50)
 
-        inum = url_to_index.get(dbrow["url"], None)
+        inum = url_to_index.get(dbrow.url, None)
         if inum is not None:
           item = mediaitems[inum]
           if item.status == MyMediaItem.STATUS_UNKNOWN:
@@ -5058,6 +7455,32 @@ def matchTextures_chunked(mediatype, mediaitems, jcomms, database, force, nodown
 
   return
 
+# Let SQLite find the library artwork present in the texture cache, so that only
+# matched rows are loaded, not the entire texture cache
+def matchTextures_join(mediatype, mediaitems, jcomms, database, force, nodownload):
+  gLogger.progress("Matching library and texture items...")
+
+  with database:
+    dbrows = joinTextureRows(database, mediaitems)
+
+  gLogger.log("Matched %d of %d items in texture cache database" % (len(dbrows) - dbrows.count(None), len(dbrows)))
+
+  for (item, dbrow) in zip(mediaitems, dbrows):
+    matchTextures_item_row(mediatype, jcomms, item, dbrow, force, nodownload)
+
+  gLogger.progress("")
+
+  return
+
+# Return the first matching texture row (or None) for each media item. Database must be open.
+def joinTextureRows(database, mediaitems):
+  dbrows = [None] * len(mediaitems)
+  if mediaitems:
+    for (inum, dbrow) in database.matchRows([item.decoded_filename for item in mediaitems]):
+      if dbrows[inum] is None:
+        dbrows[inum] = dbrow
+  return dbrows
+
 def matchTextures_item_row(mediatype, jcomms, item, dbrow, force, nodownload):
   if item.mtype == "tvshows" and item.season == "Season All": TOTALS.bump("Season-all", item.itype)
 
@@ -5075,8 +7498,12 @@ def matchTextures_item_row(mediatype, jcomms, item, dbrow, force, nodownload):
         item.status = MyMediaItem.STATUS_MISSING
 
       if item.status != MyMediaItem.STATUS_IGNORE:
-        item.dbid = dbrow["textureid"]
-        item.cachedurl = dbrow["cachedurl"]
+        item.dbid = dbrow.textureid
+        item.cachedurl = dbrow.cachedurl
+        item.imagehash = dbrow.imagehash or ""
+        if dbrow.usecount is not None:
+          item.usecount = dbrow.usecount
+          item.lastused = dbrow.lastused
       else:
         TOTALS.bump("Skipped", item.itype)
     else:
@@ -5178,10 +7605,17 @@ def parseURLData(jcomms, mediatype, mediaitems, imagecache, data, title_name, id
 #
 def evaluateURL(imgtype, url, imagecache):
   if not url or url == "":
-    TOTALS.bump("Undefined", imgtype)
+    # When sharding, only the first shard counts undefined artwork
+    if gConfig.cache_shard is None or gConfig.cache_shard[0] == 0:
+      TOTALS.bump("Undefined", imgtype)
     imagecache[""] += 1
     return False
 
+  # Artwork belonging to another shard is not counted at all, so that the
+  # totals of all shards add up to the totals of an unsharded run
+  if gConfig.cache_shard and not inCacheShard(url):
+    return False
+
   if gConfig.CACHE_ARTWORK and imgtype not in gConfig.CACHE_ARTWORK:
     if gLogger.LOGGING:
       decoded_url = MyUtility.normalise(url, strip=True)
@@ -5207,6 +7641,13 @@ def evaluateURL(imgtype, url, imagecache):
   imagecache[url] = 0
   return True
 
+# Artwork is assigned to a shard by a stable hash of the decoded URL, so every
+# process (on any host) agrees on the shard for each URL
+def inCacheShard(url):
+  (shard, shards) = gConfig.cache_shard
+  decoded_url = MyUtility.normalise(url, strip=True)
+  return (int(hashlib.md5(decoded_url.encode("utf-8")).hexdigest(), 16) % shards) == shard
+
 def qaData(mediatype, jcomms, database, data, title_name, id_name, rescan, work=None, mitems=None, showName=None, season=None, pvrGroup=None):
   gLogger.reset()
 
@@ -6402,7 +8843,7 @@ def setDetails_worker(jcomms, mtype, libraryid, kvpairs, title, dryRun, itemnum,
 
 # Extract data, using optional simple search, or complex SQL filter.
 def sqlExtract(ACTION="NONE", search="", filter="", delete=False, silent=False):
-  database = MyDB(gConfig, gLogger)
+  database = MyDB(gConfig, gLogger, readonly=(not delete))
 
   with database:
     SQL = []
@@ -6425,87 +8866,73 @@ def sqlExtract(ACTION="NONE", search="", filter="", delete=False, silent=False):
 
     FSIZE = 0
     FCOUNT = 0
-    ROWS = []
+    IDS = []
+    DELETE = []
 
     gLogger.progress("Loading database items...")
-    dbrows = []
-
-    if SQL:
-      for sql in SQL:
-        rows = database.getRows(filter=sql, allfields=True)
-        gLogger.log("EXECUTED SQL: queried %d rows" % len(rows))
-        dbrows.extend(rows)
-    else:
-      rows = database.getRows(allfields=True)
-      gLogger.log("EXECUTED SQL: queried %d rows" % len(rows))
-      dbrows.extend(rows)
-
-    rpcnt = 100.0
-    if len(dbrows) != 0:
-      rpcnt = rpcnt / len(dbrows)
 
-    i = 0
-    for row in dbrows:
-      if ACTION == "NONE":
-        ROWS.append(row)
-      else:
+    # Rows are processed as they are read, only the ids of matching
+    # rows (and cached file, if deleting) are retained
+    for sql in (SQL if SQL else [None]):
+      i = 0
+      for row in database.iterRows(filter=sql, allfields=True):
         i += 1
-        gLogger.progress("Parsing [%s] %2.0f%%..." % (row["cachedurl"], rpcnt * i), every = 50)
         if ACTION == "EXISTS":
-          if not os.path.exists(gConfig.getFilePath(row["cachedurl"])):
-            ROWS.append(row)
-          elif os.path.getsize(gConfig.getFilePath(row["cachedurl"])) == 0:
-            ROWS.append(row)
+          gLogger.progress("Parsing [%s] %d..." % (row.cachedurl, i), every = 50)
+          if os.path.exists(gConfig.getFilePath(row.cachedurl)) and \
+             os.path.getsize(gConfig.getFilePath(row.cachedurl)) != 0:
+            continue
         elif ACTION == "STATS":
-          if os.path.exists(gConfig.getFilePath(row["cachedurl"])):
-            FSIZE += os.path.getsize(gConfig.getFilePath(row["cachedurl"]))
-            ROWS.append(row)
+          gLogger.progress("Parsing [%s] %d..." % (row.cachedurl, i), every = 50)
+          if not os.path.exists(gConfig.getFilePath(row.cachedurl)):
+            continue
+          FSIZE += os.path.getsize(gConfig.getFilePath(row.cachedurl))
 
-    gLogger.progress("")
+        FCOUNT += 1
+        IDS.append(row.textureid)
+        if delete:
+          DELETE.append((row.textureid, row.cachedurl))
+        elif not silent:
+          database.dumpRow(row)
+      gLogger.log("EXECUTED SQL: queried %d rows" % i)
 
-    FCOUNT=len(ROWS)
+    gLogger.progress("")
 
     if delete:
-      i = 0
-      for row in ROWS:
-        i += 1
-        gLogger.progress("Deleting row %d (%d of %d)..." % (row["textureid"], i, FCOUNT))
-        database.deleteItem(row["textureid"], row["cachedurl"], warnmissing=False)
-        gLogger.progress("")
-    elif not silent:
-      for row in ROWS:
-        database.dumpRow(row)
+      database.deleteItems(DELETE, warnmissing=False)
 
     if ACTION == "STATS":
       gLogger.out("\nFile Summary: %s files; Total size: %s KB\n\n" % (format(FCOUNT, ",d"), format(int(FSIZE/1024), ",d")))
 
     if (search != "" or filter != "") and not delete and not silent:
-      gLogger.progress("Matching row ids: %s\n" % " ".join("%d" % r["textureid"] for r in ROWS))
+      gLogger.progress("Matching row ids: %s\n" % " ".join("%d" % id for id in IDS))
 
 # Delete row by id, and corresponding file item
 def sqlDelete(ids=[]):
   database = MyDB(gConfig, gLogger)
   with database:
+    items = []
     for id in ids:
       try:
-        database.deleteItem(int(id))
+        items.append((int(id), None))
       except ValueError:
         gLogger.out("id %s is not valid\n" % id)
         continue
+    database.deleteItems(items)
 
 def orphanCheck(removeOrphans=False):
-  database = MyDB(gConfig, gLogger)
+  database = MyDB(gConfig, gLogger, readonly=True)
 
-  dbfiles = {}
+  dbfiles = set()
   ddsmap = {}
   orphanedfiles = []
 
   gLogger.progress("Loading texture cache...")
 
   with database:
-    for r in database.getRows(allfields=False):
-      hash = r["cachedurl"]
-      dbfiles[hash] = r
+    for r in database.iterRows(allfields=False):
+      hash = r.cachedurl
+      dbfiles.add(hash)
       ddsmap[os.path.splitext(hash)[0]] = hash
 
   gLogger.log("Loaded %d rows from texture cache" % len(dbfiles))
@@ -6535,9 +8962,7 @@ def orphanCheck(removeOrphans=False):
       if hash_parts[1] == ".dds" and ddsmap.get(hash_parts[0], None):
           continue
 
-      row = dbfiles.get(hash, None)
-
-      if not row:
+      if hash not in dbfiles:
         filename = os.path.join(newroot, file)
         gLogger.log("Orphan file detected: [%s] with likely hash [%s]" % (filename, hash))
         orphanedfiles.append(filename)
@@ -6587,7 +9012,7 @@ def pruneCache(remove_nonlibrary_artwork=False):
   re_search.append(re.compile(r"^http://mirrors.kodi.tv/addons/.*"))
   re_search.append(re.compile(r"^http://mirrors.xbmc.org/addons/.*"))
 
-  database = MyDB(gConfig, gLogger)
+  database = MyDB(gConfig, gLogger, readonly=(not remove_nonlibrary_artwork))
 
   if gConfig.CHUNKED:
     pruneCache_chunked(database, libraryFiles, mediaFiles, localfiles, re_search)
@@ -6604,15 +9029,15 @@ def pruneCache(remove_nonlibrary_artwork=False):
 
   FSIZE = 0
   GOTSIZE = gConfig.HAS_THUMBNAILS_FS
-  localfiles.sort(key=lambda row: row["url"])
+  localfiles.sort(key=lambda row: row.url)
 
   with database:
     for row in localfiles:
       database.dumpRow(row)
-      if GOTSIZE and os.path.exists(gConfig.getFilePath(row["cachedurl"])):
-        FSIZE += os.path.getsize(gConfig.getFilePath(row["cachedurl"]))
-      if remove_nonlibrary_artwork:
-        database.deleteItem(row["textureid"], row["cachedurl"], warnmissing=False)
+      if GOTSIZE and os.path.exists(gConfig.getFilePath(row.cachedurl)):
+        FSIZE += os.path.getsize(gConfig.getFilePath(row.cachedurl))
+    if remove_nonlibrary_artwork:
+      database.deleteItems([(row.textureid, row.cachedurl) for row in localfiles], warnmissing=False)
 
   if GOTSIZE:
     gLogger.out("\nSummary: %s files; Total size: %s KB\n\n" \
@@ -6624,23 +9049,20 @@ def pruneCache(remove_nonlibrary_artwork=False):
 
 
 def pruneCache_fast(database, libraryFiles, mediaFiles, localfiles, re_search):
-  gLogger.progress("Loading texture cache...")
+  gLogger.progress("Processing texture cache...")
 
-  dbfiles = {}
+  # Rows are processed as they are read - a texture with several sizes
+  # is returned once per size, but should only be processed once
+  dbfiles = set()
 
   with database:
-    for r in database.getRows(allfields=True):
-      dbfiles[r["cachedurl"]] = r
-
-  totalrows = len(dbfiles)
-
-  gLogger.log("Loaded %d rows from texture cache" % totalrows)
-
-  gLogger.progress("Processing texture cache...")
+    for r in database.iterRows(allfields=True):
+      if r.cachedurl in dbfiles: continue
+      dbfiles.add(r.cachedurl)
+      gLogger.progress("Processing texture cache... %d" % len(dbfiles), every=25)
+      pruneCache_processrow(r, libraryFiles, mediaFiles, localfiles, re_search)
 
-  for rownum, hash in enumerate(dbfiles):
-    gLogger.progress("Processing texture cache... %d%%" % (100 * rownum / totalrows), every=25)
-    pruneCache_processrow(dbfiles[hash], libraryFiles, mediaFiles, localfiles, re_search)
+  gLogger.log("Loaded %d rows from texture cache" % len(dbfiles))
 
   gLogger.progress("")
 
@@ -6650,20 +9072,16 @@ def pruneCache_chunked(database, libraryFiles, mediaFiles, localfiles, re_search
   with database:
     folders = database.getTextureFolders()
 
-    for fnum, folder in enumerate(folders):
+    for fnum, (folder, dbrows) in enumerate(database.iterTextureFolders(allfields=True)):
       gLogger.progress("Loading Textures DB: chunk %2d of %d..." % (fnum+1, len(folders)))
 
-      dbfiles = []
-      dbrows = database.getRows(database.getTextureFolderFilter(folder), allfields=True)
-
       i = 0
-      j = len(dbrows)
 
       for dbrow in dbrows:
         i += 1
 
-        gLogger.progress("Processing artwork: chunk %2d of %d (%d%%)" %
-          (fnum+1, len(folders), (100 * i / j)), every=25, finalItem=(i == j))
+        gLogger.progress("Processing artwork: chunk %2d of %d (%d)" %
+          (fnum+1, len(folders), i), every=25)
 
         pruneCache_processrow(dbrow, libraryFiles, mediaFiles, localfiles, re_search)
 
@@ -6671,7 +9089,7 @@ def pruneCache_chunked(database, libraryFiles, mediaFiles, localfiles, re_search
 
 def pruneCache_processrow(row, libraryFiles, mediaFiles, localfiles, re_search):
 
-  URL = row["url"]
+  URL = row.url
   isRetained = False
 
   if gConfig.PRUNE_RETAIN_TYPES:
@@ -6841,29 +9259,37 @@ def getAllFiles(keyFunction):
 
   tvdata = jcomms.getDataProxy("tvshows", REQUEST, uniquecast=UCAST)
 
+  # Load seasons and episodes for groups of TV shows, using batched requests
   if "result" in tvdata and "tvshows" in tvdata["result"]:
-    for tvshow in tvdata["result"]["tvshows"]:
-      gLogger.progress("Loading TV show: %s..." % tvshow["title"])
-      tvshowid = tvshow["tvshowid"]
+    tvshows = tvdata["result"]["tvshows"]
+    BATCH_SIZE = max(gConfig.RPC_BATCHSIZE, 1)
+    for start in range(0, len(tvshows), BATCH_SIZE):
+      requests = []
+      for tvshow in tvshows[start:start + BATCH_SIZE]:
+        gLogger.progress("Loading TV show: %s..." % tvshow["title"])
 
-      for a in tvshow.get("art", {}):
-        afiles[keyFunction(tvshow["art"][a])] = a
+        for a in tvshow.get("art", {}):
+          afiles[keyFunction(tvshow["art"][a])] = a
 
-      for c in tvshow.get("cast", []):
-        if "thumbnail" in c:
-          afiles[keyFunction(c["thumbnail"])] = "cast.thumb"
+        for c in tvshow.get("cast", []):
+          if "thumbnail" in c:
+            afiles[keyFunction(c["thumbnail"])] = "cast.thumb"
 
-      for file in jcomms.getExtraArt(tvshow):
-        afiles[keyFunction(file["file"])] = file["type"]
+        for file in jcomms.getExtraArt(tvshow):
+          afiles[keyFunction(file["file"])] = file["type"]
 
-      REQUEST = {"method":"VideoLibrary.GetSeasons",
-                 "params":{"tvshowid": tvshowid,
-                           "sort": {"order": "ascending", "method": "season"},
-                           "properties":["season", "art"]}}
+        requests.append({"method":"VideoLibrary.GetSeasons",
+                         "params":{"tvshowid": tvshow["tvshowid"],
+                                   "sort": {"order": "ascending", "method": "season"},
+                                   "properties":["season", "art"]}})
 
-      seasondata = jcomms.getDataProxy("seasons", REQUEST, uniquecast=UCAST)
+      gLogger.progress("Loading TV shows: seasons %d of %d..." % (start + len(requests), len(tvshows)))
+
+      seasons = []
+      for (tvshow, seasondata) in zip(tvshows[start:start + BATCH_SIZE], jcomms.getDataProxyBatch("seasons", requests, uniquecast=UCAST)):
+        if "seasons" not in seasondata.get("result", {}):
+          continue
 
-      if "seasons" in seasondata["result"]:
         SEASON_ALL = True
         for season in seasondata["result"]["seasons"]:
           seasonid = season["season"]
@@ -6871,8 +9297,6 @@ def getAllFiles(keyFunction):
             gLogger.err("WARNING: TV show [%s] has invalid season (%d) - ignored" % (tvshow["title"], seasonid), newLine=True)
             continue
 
-          gLogger.progress("Loading TV show: %s, season %d..." % (tvshow["title"], seasonid))
-
           for a in season.get("art", {}):
             if SEASON_ALL and a in ["poster", "tvshow.poster", "tvshow.fanart", "tvshow.banner"]:
               SEASON_ALL = False
@@ -6882,25 +9306,25 @@ def getAllFiles(keyFunction):
               if banner_url: afiles[keyFunction(banner_url)] = "banner"
             afiles[keyFunction(season["art"][a])] = a
 
-          REQUEST = {"method":"VideoLibrary.GetEpisodes",
-                     "params":{"tvshowid": tvshowid, "season": seasonid,
-                               "properties":["cast", "art", "file"]}}
+          seasons.append({"method":"VideoLibrary.GetEpisodes",
+                          "params":{"tvshowid": tvshow["tvshowid"], "season": seasonid,
+                                    "properties":["cast", "art", "file"]}})
 
-          episodedata = jcomms.getDataProxy("episodes", REQUEST, uniquecast=UCAST)
-          if "episodes" not in episodedata["result"]:
-            continue # ignore seasons without episodes
+      gLogger.progress("Loading TV shows: episodes %d of %d..." % (start + len(requests), len(tvshows)))
 
-          for episode in episodedata["result"]["episodes"]:
-            episodeid = episode["episodeid"]
+      for episodedata in jcomms.getDataProxyBatch("episodes", seasons, uniquecast=UCAST):
+        if "episodes" not in episodedata.get("result", {}):
+          continue # ignore seasons without episodes
 
-            mfiles[episode["file"]] = "media"
+        for episode in episodedata["result"]["episodes"]:
+          mfiles[episode["file"]] = "media"
 
-            for a in episode.get("art", {}):
-              afiles[keyFunction(episode["art"][a])] = a
+          for a in episode.get("art", {}):
+            afiles[keyFunction(episode["art"][a])] = a
 
-            for c in episode.get("cast", []):
-              if "thumbnail" in c:
-                afiles[keyFunction(c["thumbnail"])] = "cast.thumb"
+          for c in episode.get("cast", []):
+            if "thumbnail" in c:
+              afiles[keyFunction(c["thumbnail"])] = "cast.thumb"
 
       # Free memory used to cache any GetDirectory() information
       MyUtility.invalidateDirectoryCache("TVShows")
@@ -6963,7 +9387,7 @@ def removeMedia(mtype, libraryid):
 
 # Remove artwork URLs containing specified patterns, with or without lasthaschcheck
 def purgeArtwork(patterns, hashType="all", dryRun=True):
-  database = MyDB(gConfig, gLogger)
+  database = MyDB(gConfig, gLogger, readonly=dryRun)
 
   SQL = "WHERE"
   if not gConfig.USEJSONDB or gConfig.JSON_HAS_FILTERNULLVALUE:
@@ -6994,20 +9418,19 @@ def purgeArtwork(patterns, hashType="all", dryRun=True):
         newrows = []
         for r in rows:
           if (hashType == "all") or \
-             (hashType == "hashed" and r["lasthashcheck"]) or \
-             (hashType == "unhashed" and not r["lasthashcheck"]):
+             (hashType == "hashed" and r.lasthashcheck) or \
+             (hashType == "unhashed" and not r.lasthashcheck):
             newrows.append(r)
         rows = newrows
         newrows = None
 
       gLogger.out("Purging %d (%s) items for pattern: %s" % (len(rows), hashType, pattern), newLine=True)
 
-      for r in rows:
-        if dryRun:
-          gLogger.out("Dry-run, would remove: %s" % r["url"], newLine=True)
-        else:
-          gLogger.progress("Removing: %s" % r["url"])
-          database.deleteItem(r["textureid"], r["cachedurl"], warnmissing=False)
+      if dryRun:
+        for r in rows:
+          gLogger.out("Dry-run, would remove: %s" % r.url, newLine=True)
+      else:
+        database.deleteItems([(r.textureid, r.cachedurl) for r in rows], warnmissing=False)
 
       gLogger.progress("")
 
@@ -7093,19 +9516,20 @@ def get_mangled_artwork(jcomms):
   tvdata = jcomms.sendJSON(REQUEST, "libTV")
 
   if "result" in tvdata and "tvshows" in tvdata["result"]:
-    for tvshow in tvdata["result"]["tvshows"]:
-      gLogger.progress("Loading TV show: %s..." % tvshow["title"])
-
-      tvshowid = tvshow["tvshowid"]
+    tvshows = tvdata["result"]["tvshows"]
+    requests = []
+    for tvshow in tvshows:
       addItems(tvshow, "tvshow", "tvshowid")
 
-      REQUEST = {"method":"VideoLibrary.GetSeasons",
-                 "params":{"tvshowid": tvshowid,
-                           "sort": {"order": "ascending", "method": "season"},
-                           "properties":["season", "art"]}}
+      requests.append({"method":"VideoLibrary.GetSeasons",
+                       "params":{"tvshowid": tvshow["tvshowid"],
+                                 "sort": {"order": "ascending", "method": "season"},
+                                 "properties":["season", "art"]}})
 
-      seasondata = jcomms.sendJSON(REQUEST, "libTV")
+    gLogger.progress("Loading TV shows: seasons...")
 
+    requests_episodes = []
+    for (tvshow, seasondata) in zip(tvshows, jcomms.sendJSONBatch(requests, "libTV")):
       if "seasons" in seasondata["result"]:
         for season in seasondata["result"]["seasons"]:
           seasonid = season["season"]
@@ -7113,20 +9537,19 @@ def get_mangled_artwork(jcomms):
             gLogger.err("WARNING: TV show [%s] has invalid season (%d) - ignored" % (tvshow["title"], seasonid), newLine=True)
             continue
 
-          gLogger.progress("Loading TV show: [%s, season %d]..." % (tvshow["title"], seasonid))
-
           # Can't set items on season unless seasonid is present...
           if "seasonid" in season:
             addItems(season, "season", "seasonid")
 
-          REQUEST = {"method":"VideoLibrary.GetEpisodes",
-                     "params":{"tvshowid": tvshowid, "season": seasonid,
-                               "properties":["art"]}}
+          requests_episodes.append({"method":"VideoLibrary.GetEpisodes",
+                                    "params":{"tvshowid": tvshow["tvshowid"], "season": seasonid,
+                                              "properties":["art"]}})
 
-          episodedata = jcomms.sendJSON(REQUEST, "libTV")
+    gLogger.progress("Loading TV shows: episodes...")
 
-          for episode in episodedata["result"]["episodes"]:
-            addItems(episode, "episode", "episodeid")
+    for episodedata in jcomms.sendJSONBatch(requests_episodes, "libTV"):
+      for episode in episodedata["result"]["episodes"]:
+        addItems(episode, "episode", "episodeid")
 
   files = []
   for f in allfiles:
@@ -7685,7 +10108,7 @@ def usage(EXIT_CODE):
   print("Version: %s" % gConfig.VERSION)
   print("")
   pprint("[s, S] <string> | [x, X, f, F] [sql-filter] | Xd | d <id[id id]>] | \
-          c [class [filter]] | nc [class [filter]] | lc [class] | lnc [class] | C class filter | \
+          c [class [filter]] | nc [class [filter]] | lc [class] | lnc [class] | C class filter | resume | mergeshards file [file]* | \
           [j, J, jd, Jd, jr, Jr] class [filter] | qa class [filter] | qax class [filter] | [p, P] | [r, R] | \
           imdb movies [filter] | imdb tvshows [filter] | \
           purge hashed;unhashed;all pattern [pattern [pattern]] | \
@@ -7723,6 +10146,8 @@ def usage(EXIT_CODE):
   print("  lc         Like c, but only for content added since the modification date of the file specficied in property lastrunfile")
   print("  lnc        Like nc, but only for content added since the modification date of the file specficied in property lastrunfile")
   print("  lC         Like C, but only for content added since the modification date of the file specficied in property lastrunfile")
+  print("  resume     Resume an interrupted c/C run, caching only the outstanding items recorded in the journal specified by property cache.journal")
+  print(" mergeshards Combine and display the totals of c/C runs split using property cache.shard, from the files written by each run to property cache.shard.summary")
   print("  j          Query library by class (movies, tags, sets, tvshows, artists, albums or songs) with optional filter, return JSON results.")
   print("  J          Same as \"j\", but includes extra JSON audio/video fields as defined in properties file.")
   print("  jd, Jd     Functionality equivalent to j/J, but all URLs are decoded")
@@ -7833,10 +10258,10 @@ def checkConfig(option):
   jsonNeedVersion = 6
 
   # Web server access
-  optWeb = ["c", "C", "readfile"]
+  optWeb = ["c", "C", "resume", "readfile"]
 
   # Socket (JSON RPC) access
-  optSocket = ["c", "C", "nc", "lc", "lnc", "lC", "j", "J", "jd", "Jd", "jr", "Jr",
+  optSocket = ["c", "C", "resume", "nc", "lc", "lnc", "lC", "j", "J", "jd", "Jd", "jr", "Jr",
                 "qa","qax","query", "p","P",
                 "remove", "vscan", "ascan", "vclean", "aclean",
                 "directory", "rdirectory", "sources",
@@ -7849,7 +10274,7 @@ def checkConfig(option):
 
   # Database access (could be SQLite, could be JSON - needs to be determined later)
   optDb = ["s", "S", "x", "X", "Xd", "f", "F",
-           "c", "C", "nc", "lc", "lnc", "lC", "d",
+           "c", "C", "resume", "nc", "lc", "lnc", "lC", "d",
            "r", "R", "p", "P", "purge", "purgetest"]
 
   # These options require direct filesystem access
@@ -7858,7 +10283,7 @@ def checkConfig(option):
 
   # These options require direct filesystem access unless JSON Texture API is available.
   # Dependency: os.remove()
-  optFS2 = ["d", "P", "C", "purge"]
+  optFS2 = ["d", "P", "C", "resume", "purge"]
 
   # Network MAC
   optMAC = ["wake"]
@@ -8346,6 +10771,8 @@ def autoUpdate(argv):
     os.execl(sys.executable, sys.executable, *args)
 
 def main(argv):
+  global gJournal, gFailureCache
+
   loadConfig(argv)
 
   if len(argv) == 0: usage(1)
@@ -8461,16 +10888,31 @@ def main(argv):
       _multi_call.append(argv[1])
 
     if _multi_call != []:
+      if _action == "cache" and not _nodownload and gConfig.CACHE_JOURNAL:
+        gJournal = MyJournal(gConfig, gLogger)
+        gJournal.open(_force)
+      if _action == "cache" and not _nodownload and gConfig.CACHE_FAILURES:
+        gFailureCache = MyFailureCache(gConfig, gLogger)
+        gFailureCache.load()
       for _media in _multi_call:
         jsonQuery(_action, mediatype=_media, filter=_filter,
                   force=_force, lastRun=_lastRun, nodownload=_nodownload,
                   rescan=_rescan, decode=_decode, ensure_ascii=_ensure_ascii,
                   extraFields=_extraFields, query=_query, drop_items=_drop_items)
+      if gJournal: gJournal.close()
+      if gFailureCache: gFailureCache.save()
       if _action == "cache": dump_drop_items(_drop_items)
+      if _action == "cache" and gConfig.CACHE_SHARD_SUMMARY: writeShardSummary(_multi_call, _filter)
       if _stats: TOTALS.libraryStats(multi=_multi_call, filter=_filter, lastRun=_lastRun, query=_query)
     else:
       usage(1)
 
+  elif argv[0] == "resume" and len(argv) == 1:
+    resumeCache()
+
+  elif argv[0] == "mergeshards" and len(argv) >= 2:
+    mergeShards(argv[1:])
+
   elif argv[0] == "duplicates":
     jsonQuery("duplicates", "movies")
 